@@ -2,12 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import math
 import os
 import platform
 import sys
 import time
 import traceback
-from multiprocessing import JoinableQueue  # for then number of cpus
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 
 from pg_view import consts
@@ -40,6 +41,11 @@ except ImportError:
     print('Unable to import ncurses, curses output will be unavailable')
     curses_available = False
 
+if sys.hexversion >= 0x03000000:
+    from queue import Queue
+else:
+    from Queue import Queue
+
 
 def parse_args():
     """parse command-line options"""
@@ -94,26 +100,40 @@ def loop(collectors, consumer, groups, output_method):
 
 def poll_keys(screen, output):
     c = screen.getch()
+    if c == -1:
+        # no key has been pressed, the usual case
+        return True
+    if c == ord('q'):
+        # bail out immediately
+        return False
     if c == ord('u'):
         flags.display_units = flags.display_units is False
-    if c == ord('f'):
+    elif c == ord('f'):
         flags.freeze = flags.freeze is False
-    if c == ord('s'):
+    elif c == ord('s'):
         flags.filter_aux = flags.filter_aux is False
-    if c == ord('h'):
+    elif c == ord('h'):
         output.toggle_help()
-    if c == ord('a'):
+    elif c == ord('a'):
         flags.autohide_fields = flags.autohide_fields is False
-    if c == ord('t'):
+    elif c == ord('t'):
         flags.notrim = flags.notrim is False
-    if c == ord('r'):
+    elif c == ord('r'):
         flags.realtime = flags.realtime is False
-    if c == ord('q'):
-        # bail out immediately
-        return False
     return True
 
 
+def wait_for_keys(screen, output, timeout):
+    """ block in getch for up to timeout seconds, so that a key press is processed as soon as it arrives """
+    # round up, a timeout of 0 would return right away and make us spin until the tick is due
+    screen.timeout(int(math.ceil(timeout * 1000)))
+    try:
+        return poll_keys(screen, output)
+    finally:
+        # the keys are polled without waiting while the collectors are refreshed
+        screen.nodelay(1)
+
+
 def do_loop(screen, groups, output_method, collectors, consumer):
     """ Display output (or pass it through to ncurses) """
 
@@ -129,33 +149,54 @@ def do_loop(screen, groups, output_method, collectors, consumer):
                 sys.exit(1)
     else:
         output = CommonOutput()
+    # the collectors are independent and mostly wait for /proc and the database, refresh them in parallel
+    collector_pool = ThreadPool(len(collectors))
+    # Python 2 has no monotonic clock
+    clock = getattr(time, 'monotonic', time.time)
+    # the ticks start TICK_LENGTH apart, no matter how long it takes to produce the output
+    next_tick = clock()
     while 1:
-        # process input:
-        consumer.consume()
-        for st in collectors:
+        if flags.realtime:
+            # no waiting between the ticks
+            next_tick = clock()
+        # a key pressed while waiting ends the wait early, keep waiting until the tick is due
+        if clock() >= next_tick:
+            next_tick += consts.TICK_LENGTH
+            # process input:
+            consumer.consume()
             if output_method == OUTPUT_METHOD.curses and not poll_keys(screen, output):
                 # bail out immediately
                 return
-            st.set_units_display(flags.display_units)
-            st.set_ignore_autohide(not flags.autohide_fields)
-            st.set_notrim(flags.notrim)
-            process_single_collector(st)
-            if output_method == OUTPUT_METHOD.curses and not poll_keys(screen, output):
-                return
-
-        if output_method == OUTPUT_METHOD.curses:
-            process_groups(groups)
-        # in the non-curses cases display actually shows the data and refresh
-        # clears the screen, so we need to refresh before display to clear the old data.
-        if options.clear_screen and output_method != OUTPUT_METHOD.curses:
-            output.refresh()
-        for st in collectors:
-            output.display(st.output(output_method))
-        # in the curses case, refresh shows the data queued by display
-        if output_method == OUTPUT_METHOD.curses:
-            output.refresh()
+            for st in collectors:
+                st.set_units_display(flags.display_units)
+                st.set_ignore_autohide(not flags.autohide_fields)
+                st.set_notrim(flags.notrim)
+            # curses is only touched from this thread
+            collector_pool.map(process_single_collector, collectors)
+
+            if output_method == OUTPUT_METHOD.curses:
+                process_groups(groups)
+            # in the non-curses cases display actually shows the data and refresh
+            # clears the screen, so we need to refresh before display to clear the old data.
+            if options.clear_screen and output_method != OUTPUT_METHOD.curses:
+                output.refresh()
+            for st in collectors:
+                output.display(st.output(output_method))
+            # in the curses case, refresh shows the data queued by display
+            if output_method == OUTPUT_METHOD.curses:
+                output.refresh()
         if not flags.realtime:
-            time.sleep(consts.TICK_LENGTH)
+            wait = next_tick - clock()
+            if wait < 0:
+                # we are late, start counting from now instead of trying to catch up
+                next_tick -= wait
+                wait = 0
+            wait = min(wait, consts.TICK_LENGTH)
+            if output_method == OUTPUT_METHOD.curses:
+                if not wait_for_keys(screen, output, wait):
+                    return
+            else:
+                time.sleep(wait)
 
 
 def main():
@@ -253,8 +294,8 @@ def main():
                          'or specify connection parameters manually in the configuration file (-c)')
             sys.exit(1)
 
-        # initialize the disks stat collector process and create an exchange queue
-        q = JoinableQueue(1)
+        # initialize the disks stat collector thread and create an exchange queue
+        q = Queue(1)
         work_directories = [cl['wd'] for cl in clusters if 'wd' in cl]
         dbversion = dbversion or clusters[0]['ver']
 
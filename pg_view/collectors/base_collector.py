@@ -57,12 +57,35 @@ class StatCollector(object):
                                 OUTPUT_METHOD.curses: self.ncurses_output}
         self.cook_function = {OUTPUT_METHOD.curses: self.curses_cook_value}
         self.ncurses_custom_fields = dict.fromkeys(StatCollector.NCURSES_CUSTOM_OUTPUT_FIELDS, None)
+        # (output name, output_transform_data column) pairs, refreshed together with the output header
+        self._cook_meta = ()
+        # output header and the static name-keyed curses maps built for it, see _get_header_maps
+        self._header_maps = (None, None)
+        # specialized versions of _transform_list and _transform_dict for transform_list_data
+        # and transform_dict_data, set up in postinit
+        self._list_transformer = None
+        self._dict_transformer = None
 
     def postinit(self):
         for n in [self.transform_list_data, self.transform_dict_data, self.diff_generator_data,
                   self.output_transform_data]:
             self.validate_list_out(n)
         self.output_column_positions = self._calculate_output_column_positions()
+        # status functions run for every row, let them index the row directly
+        for col in self.output_transform_data:
+            col['_pos'] = self.output_column_positions[col['out']]
+        # curses layout options are static, except for the width that is re-calculated on every output
+        self._ncurses_options = dict((opt, [col.get(opt, default) for col in self.output_transform_data])
+                                     for opt, default in StatCollector.NCURSES_DEFAULTS.items() if opt != 'w')
+        self._highlights = self._get_highlights()
+        # (output name, input name, copy as is, diff function) for every diffed column
+        self._diff_plan = tuple((col['out'], col.get('in') or col['out'], col.get('diff') is False, col.get('fn'))
+                                for col in self.diff_generator_data)
+        # (column, status function, thresholds) for every output column, in the output order
+        self._status_plan = tuple((col, col.get('status_fn'), self._get_status_thresholds(col))
+                                  for col in self.output_transform_data)
+        self._list_transformer = self._compile_transformation(self.transform_list_data, positional=True)
+        self._dict_transformer = self._compile_transformation(self.transform_dict_data, positional=False)
 
     def set_ignore_autohide(self, new_status):
         self.ignore_autohide = new_status
@@ -246,7 +269,7 @@ class StatCollector(object):
         return result
 
     def time_field_status(self, row, col):
-        val = row[self.output_column_positions[col['out']]]
+        val = row[col['_pos']]
         num = StatCollector.time_field_to_seconds(val)
         if num <= col['critical']:
             return {-1: COLSTATUS.cs_critical}
@@ -284,38 +307,35 @@ class StatCollector(object):
         self.ncurses_custom_fields['prefix'] = new_prefix
 
     def cook_row(self, row, header, method):
-        cooked_vals = []
-        if not self.cook_function.get(method):
+        cook_fn = self.cook_function.get(method)
+        if not cook_fn:
             return row
         if len(row) != len(header):
             logger.error(
                 'Unable to cook row with non-matching number of header and value columns: ' +
                 'row {0} header {1}'.format(row, header)
             )
-        cook_fn = self.cook_function[method]
-        for no, val in enumerate(row):
-            # if might be tempting to just get the column from output_transform_data using
-            # the header, but it's wrong: see _produce_output_name for details. This, of
-            # course, assumes the number of columns in the output_transform_data is the
-            # same as in row: thus, we need to avoid filtering rows in the collector.
-            newval = cook_fn(val, header[no], self.output_transform_data[no])
-            cooked_vals.append(newval)
-        return cooked_vals
+        # if might be tempting to just get the column from output_transform_data using
+        # the header, but it's wrong: see _produce_output_name for details. This, of
+        # course, assumes the number of columns in the output_transform_data is the
+        # same as in row: thus, we need to avoid filtering rows in the collector.
+        return [cook_fn(attname, val, col) for val, (attname, col) in zip(row, self._cook_meta)]
 
     def curses_cook_value(self, attname, raw_val, output_data):
         """ return cooked version of the row, with values transformed. A transformation is
             the same for all columns and depends on the values only.
         """
-        val = raw_val
-        header = str(attname)
         # change the None output to ''
         if raw_val is None:
             return ColumnType(value='', header='', header_position=None)
-        if str(raw_val) == 'True':
+        if raw_val is True:
             val = 'T'
-        elif str(raw_val) == 'False':
+        elif raw_val is False:
             val = 'F'
-        if output_data.get('maxw', 0) > 0 and not self.notrim and len(str(val)) > output_data['maxw']:
+        else:
+            val = str(raw_val)
+        header = str(attname)
+        if output_data.get('maxw', 0) > 0 and not self.notrim and len(val) > output_data['maxw']:
             # if the value is larger than the maximum allowed width - trim it by removing chars from the middle
             val = self._trim_text_middle(val, output_data['maxw'])
         if self.ncurses_custom_fields.get('prepend_column_headers') or output_data.get(
@@ -326,7 +346,7 @@ class StatCollector(object):
         else:
             header = ''
             header_position = None
-        return ColumnType(value=str(val), header=header, header_position=header_position)
+        return ColumnType(value=val, header=header, header_position=header_position)
 
     @staticmethod
     def _trim_text_middle(val, maxw):
@@ -358,22 +378,25 @@ class StatCollector(object):
         if not self.produce_diffs:
             return {}
         result = {}
-        for col in self.diff_generator_data:
-            # Only process attributes for which out it set.
-            attname = col['out']
-            incol = (col['in'] if 'in' in col and col['in'] else attname)
+        diff_time = self.diff_time
+        for attname, incol, copy, fn in self._diff_plan:
             # if diff is False = copy the attribute as is.
-            if 'diff' in col and col['diff'] is False:
-                result[attname] = (cur[incol] if incol in cur else None)
-            elif 'fn' in col:
+            if copy:
+                result[attname] = cur.get(incol)
+                continue
+            cur_val = cur.get(incol)
+            prev_val = prev.get(incol)
+            if cur_val is None or prev_val is None:
+                result[attname] = None
+            elif fn is not None:
                 # if diff is True and fn is supplied - apply it to the current and previous row.
-                result[attname] = (col['fn'](incol, cur, prev) if cur.get(incol, None) is not None and prev.get(incol,
-                                   None) is not None else None)
-            else:
+                result[attname] = fn(incol, cur, prev)
+            elif diff_time >= 0:
                 # default case - calculate the diff between the current attribute's values of
                 # old and new rows and divide it by the time interval passed between measurements.
-                result[attname] = ((cur[incol] - prev[incol]) / self.diff_time if cur.get(incol, None) is not None and
-                                   prev.get(incol, None) is not None and self.diff_time >= 0 else None)
+                result[attname] = (cur_val - prev_val) / diff_time
+            else:
+                result[attname] = None
         return result
 
     def _produce_output_row(self, row):
@@ -415,7 +438,20 @@ class StatCollector(object):
         return attname
 
     @staticmethod
-    def _calculate_output_status(row, col, val, method):
+    def _get_status_thresholds(col):
+        """ Return the (bound, type, status) triples for the 'critical' and 'warning' column options """
+
+        result = []
+        for st_name, st_status in (('critical', COLSTATUS.cs_critical), ('warning', COLSTATUS.cs_warning)):
+            if st_name in col:
+                typ = type(col[st_name])
+                if typ == int:
+                    typ = float
+                result.append((col[st_name], typ, st_status))
+        return tuple(result)
+
+    @staticmethod
+    def _calculate_output_status(row, col, val, status_fn, thresholds):
         """ Examine the current status indicators and produce the status
             value for the specific column of the given row
         """
@@ -424,22 +460,18 @@ class StatCollector(object):
         # if value is missing - don't bother calculating anything
         if val is None:
             return st
-        if 'status_fn' in col:
-            st = col['status_fn'](row, col)
+        if status_fn is not None:
+            st = status_fn(row, col)
             if len(st) == 0:
                 st = {-1: COLSTATUS.cs_ok}
         else:
             words = str(val).split()
             for i, word in enumerate(words):
-                for st_name, st_status in zip(('critical', 'warning'), (COLSTATUS.cs_critical, COLSTATUS.cs_warning)):
-                    if st_name in col:
-                        typ = type(col[st_name])
-                        if typ == int:
-                            typ = float
-                        if typ(word) >= col[st_name]:
-                            st[i] = st_status
-                            break
-                if i not in st:
+                for bound, typ, st_status in thresholds:
+                    if typ(word) >= bound:
+                        st[i] = st_status
+                        break
+                else:
                     st[i] = COLSTATUS.cs_ok
         return st
 
@@ -447,13 +479,13 @@ class StatCollector(object):
         """ scan the (cooked) rows, do not show columns that are empty """
 
         to_skip = []
-        for col in self.output_transform_data:
+        for idx, col in enumerate(self.output_transform_data):
             if col.get('pos') == -1:
                 continue
             attname = self._produce_output_name(col)
             empty = True
             for r in result_rows:
-                if r[attname].value != '':
+                if r[idx].value != '':
                     empty = False
                     break
             if empty:
@@ -461,9 +493,9 @@ class StatCollector(object):
             elif col.get('hide_if_ok', False):
                 status_ok = True
                 for row in status_rows:
-                    if attname in row and row[attname]:
-                        for cl in row[attname]:
-                            if row[attname][cl] != COLSTATUS.cs_ok:
+                    if row[idx]:
+                        for cl in row[idx]:
+                            if row[idx][cl] != COLSTATUS.cs_ok:
                                 status_ok = False
                                 break
                     if not status_ok:
@@ -487,6 +519,8 @@ class StatCollector(object):
     # column is the same as the out one, the list emits the warning and skips
     # the column.
     def _transform_list(self, x, custom_transformation_data=None):
+        if custom_transformation_data is None and self._list_transformer is not None:
+            return self._list_transformer(x)
         result = {}
         # choose between the 'embedded' and external transformations
         if custom_transformation_data is not None:
@@ -523,8 +557,43 @@ class StatCollector(object):
             return result
         raise Exception('No data for the list transformation supplied')
 
+    def _compile_transformation(self, transformation_data, positional):
+        """ Return a function doing the same as _transform_list (positional) or _transform_dict
+            with the given transformation_data.
+
+            The column options are resolved once here instead of on every call.
+        """
+        if not transformation_data:
+            return None
+        plan = tuple((col['out'], col.get('in') if positional else self._get_input_column_name(col),
+                      col.get('fn'), col.get('optional', False), col.get('infn'))
+                     for col in transformation_data)
+        warn = self.warn_non_optional_column
+
+        def transform(x):
+            result = {}
+            total = len(x)
+            for attname, incol, fn, optional, infn in plan:
+                if infn is not None:
+                    val = infn(attname, x, optional) if total > 0 else None
+                elif (incol < total) if positional else (incol in x):
+                    val = x[incol]
+                else:
+                    # see _transform_list on when the missing columns are reported
+                    val = None
+                    if not optional and total > 0:
+                        warn(incol)
+                if fn is not None and val is not None:
+                    val = fn(val)
+                result[attname] = val
+            return result
+
+        return transform
+
     # Most of the functionality is the same as in the dict transforming function above.
     def _transform_dict(self, x, custom_transformation_data=None):
+        if custom_transformation_data is None and self._dict_transformer is not None:
+            return self._dict_transformer(x)
         result = {}
         if custom_transformation_data is not None:
             transformation_data = custom_transformation_data
@@ -625,54 +694,57 @@ class StatCollector(object):
     def _calculate_dynamic_width(self, rows, method=OUTPUT_METHOD.console):
         """ Examine values in all rows and get the width dynamically """
 
+        prepend_column_headers = False
+        if method == OUTPUT_METHOD.curses:
+            rows = [row for row in rows if not self.ncurses_filter_row(row)]
+            prepend_column_headers = self.ncurses_custom_fields.get('prepend_column_headers')
+        cook_fn = self.cook_function.get(method)
+        produce_output_value = self._produce_output_value
         for col in self.output_transform_data:
             minw = col.get('minw', 0)
             attname = self._produce_output_name(col)
             # XXX:  if append_column_header, min width should include the size of the attribut name
-            if method == OUTPUT_METHOD.curses and self.ncurses_custom_fields.get('prepend_column_headers'):
+            if prepend_column_headers:
                 minw += len(attname) + 1
             col['w'] = len(attname)
+            if not rows:
+                continue
             # use cooked values
-            for row in rows:
-                if method == OUTPUT_METHOD.curses and self.ncurses_filter_row(row):
-                    continue
-                val = self._produce_output_value(row, col, method)
-                if self.cook_function.get(method):
-                    val = self.cook_function[method](attname, val, col)
-                if method == OUTPUT_METHOD.curses:
-                    curw = val.length
-                else:
-                    curw = len(str(val))
-                if curw > col['w']:
-                    col['w'] = curw
-                if minw > 0:
-                    col['w'] = max(minw, col['w'])
+            vals = (produce_output_value(row, col, method) for row in rows)
+            if cook_fn:
+                vals = (cook_fn(attname, val, col) for val in vals)
+            if method == OUTPUT_METHOD.curses:
+                curw = max(val.length for val in vals)
+            else:
+                curw = max(len(str(val)) for val in vals)
+            col['w'] = max(minw, curw, col['w'])
 
     def _calculate_statuses_for_row(self, row, method):
-        statuses = []
-        for num, col in enumerate(self.output_transform_data):
-            statuses.append(self._calculate_output_status(row, col, row[num], method))
-        return statuses
+        return [self._calculate_output_status(row, col, val, status_fn, thresholds)
+                for val, (col, status_fn, thresholds) in zip(row, self._status_plan)]
 
     @staticmethod
-    def _calculate_column_types(rows):
+    def _calculate_column_types(header, rows):
         result = {}
         if len(rows) > 0:
-            colnames = rows[0].keys()
-            for colname in colnames:
-                for r in rows:
-                    val = r[colname]
+            # a column type is decided by its first non-empty value, stop looking at the
+            # column once it is known and stop scanning rows once all columns are known.
+            unresolved = list(enumerate(header))
+            for r in rows:
+                for idx, colname in unresolved:
+                    val = r[idx]
                     if val is None or val == '':
                         continue
+                    if isinstance(val, Number):
+                        result[colname] = COLTYPES.ct_number
                     else:
-                        if isinstance(val, Number):
-                            result[colname] = COLTYPES.ct_number
-                        else:
-                            result[colname] = COLTYPES.ct_string
-                        break
-                else:
-                    # if all values are None - we don't care, so use a generic string
-                    result[colname] = COLTYPES.ct_string
+                        result[colname] = COLTYPES.ct_string
+                unresolved = [(idx, colname) for idx, colname in unresolved if colname not in result]
+                if not unresolved:
+                    break
+            # if all values are None - we don't care, so use a generic string
+            for idx, colname in unresolved:
+                result[colname] = COLTYPES.ct_string
         return result
 
     def _get_highlights(self):
@@ -687,14 +759,11 @@ class StatCollector(object):
 
     def json_output(self, rows, before_string=None, after_string=None):
         output = {}
-        data = []
         output['type'] = StatCollector.ident(self)
         if self.__dict__.get('dbname') and self.__dict__.get('dbver'):
             output['name'] = '{0}/{1}'.format(self.dbname, self.dbver)
-        for r in rows:
-            data.append(self._produce_output_row(r))
-            output['data'] = data
-        return json.dumps(output, indent=4)
+        output['data'] = [self._produce_output_row(r) for r in rows]
+        return json.dumps(output)
 
     def ncurses_filter_row(self, row):
         return False
@@ -706,45 +775,58 @@ class StatCollector(object):
 
         self._calculate_dynamic_width(rows, method=OUTPUT_METHOD.curses)
 
-        raw_result = {}
-        for k in StatCollector.NCURSES_DEFAULTS.keys():
-            raw_result[k] = []
-
-        for col in self.output_transform_data:
-            for opt in StatCollector.NCURSES_DEFAULTS.keys():
-                raw_result[opt].append((col[opt] if opt in col else StatCollector.NCURSES_DEFAULTS[opt]))
-
         result_header = self._output_row_for_curses(None, 'h')
+        header_maps = self._get_header_maps(result_header)
         result_rows = []
         status_rows = []
         values_rows = []
 
         for r in rows:
-            values_row = self._output_row_for_curses(r, 'v')
-            if self.ncurses_filter_row(dict(zip(result_header, values_row))):
+            if self.ncurses_filter_row(r):
                 continue
-            cooked_row = self.cook_row(result_header, values_row, method=OUTPUT_METHOD.curses)
+            values_row = self._output_row_for_curses(r, 'v')
+            cooked_row = self.cook_row(values_row, result_header, method=OUTPUT_METHOD.curses)
             status_row = self._calculate_statuses_for_row(values_row, method=OUTPUT_METHOD.curses)
-            result_rows.append(dict(zip(result_header, cooked_row)))
-            status_rows.append(dict(zip(result_header, status_row)))
-            values_rows.append(dict(zip(result_header, values_row)))
+            result_rows.append(cooked_row)
+            status_rows.append(status_row)
+            values_rows.append(values_row)
 
-        types_row = self._calculate_column_types(values_rows)
+        types_row = self._calculate_column_types(result_header, values_rows)
 
-        result = {'rows': result_rows,
-                  'statuses': status_rows,
-                  'hide': self._get_columns_to_hide(result_rows, status_rows),
-                  'highlights': dict(zip(result_header, self._get_highlights())),
-                  'types': types_row}
+        result = dict(header_maps)
+        result.update({'rows': result_rows,
+                       'statuses': status_rows,
+                       'hide': self._get_columns_to_hide(result_rows, status_rows),
+                       'types': types_row})
         for x in StatCollector.NCURSES_CUSTOM_OUTPUT_FIELDS:
             result[x] = self.ncurses_custom_fields.get(x, None)
-        for k in StatCollector.NCURSES_DEFAULTS.keys():
-            if k == 'noautohide' and self.ignore_autohide:
-                result[k] = dict.fromkeys(result_header, True)
-            else:
-                result[k] = dict(zip(result_header, raw_result[k]))
+        # the width is the only layout option re-calculated on every output
+        result['w'] = dict((name, col.get('w', StatCollector.NCURSES_DEFAULTS['w']))
+                           for name, col in self._cook_meta)
+        if self.ignore_autohide:
+            result['noautohide'] = dict.fromkeys(result_header, True)
         return {self.ident(): result}
 
+    def _get_header_maps(self, header):
+        """ Return the name-keyed curses maps that only change together with the output header.
+
+            The header only changes when the units display is toggled, so the maps are built
+            once and shared between refreshes. The curses output treats them as read-only.
+        """
+        header = tuple(header)
+        if self._header_maps[0] != header:
+            # rows and statuses are positional, 'columns' maps the output names to positions
+            maps = {'columns': dict((name, idx) for idx, name in enumerate(header)),
+                    'highlights': dict(zip(header, self._highlights))}
+            for opt, values in self._ncurses_options.items():
+                maps[opt] = dict(zip(header, values))
+            # visible columns in the order of their positions on the screen
+            visible = [(name, pos) for name, pos in zip(header, self._ncurses_options['pos']) if pos != -1]
+            maps['sorted_fields'] = [name for name, pos in sorted(visible, key=lambda x: x[1])]
+            self._cook_meta = tuple(zip(header, self.output_transform_data))
+            self._header_maps = (header, maps)
+        return self._header_maps[1]
+
     def output(self, method, before_string=None, after_string=None):
         if method not in self.output_function:
             raise Exception('Output method {0} is not supported'.format(method))
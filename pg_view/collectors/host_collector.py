@@ -1,11 +1,13 @@
 import os
 import socket
+import time
 from datetime import timedelta
 from multiprocessing import cpu_count
 
 from pg_view.collectors.base_collector import StatCollector
 from pg_view.loggers import logger
 from pg_view.models.outputs import COLSTATUS, COLHEADER
+from pg_view.utils import read_small_file
 
 
 class HostStatCollector(StatCollector):
@@ -13,6 +15,7 @@ class HostStatCollector(StatCollector):
     """ General system-wide statistics """
 
     UPTIME_FILE = '/proc/uptime'
+    UPTIME_REREAD_INTERVAL = 60  # seconds between /proc/uptime reads, the uptime is extrapolated in between
 
     def __init__(self):
         super(HostStatCollector, self).__init__(produce_diffs=False)
@@ -64,6 +67,12 @@ class HostStatCollector(StatCollector):
 
         self.postinit()
 
+        # neither of these change while we are running
+        self.hostname = {'hostname': socket.gethostname()}
+        self.uname = self._transform_list(os.uname(), self.transform_uname_data)
+        self.uptime = None
+        self.uptime_read_time = None
+
     def refresh(self):
         raw_result = {}
         raw_result.update(self._read_uptime())
@@ -78,7 +87,7 @@ class HostStatCollector(StatCollector):
 
     def _load_avg_state(self, row, col):
         state = {}
-        load_avg_str = row[self.output_column_positions[col['out']]]
+        load_avg_str = row[col['_pos']]
         if not load_avg_str:
             return {}
         # load average consists of 3 values.
@@ -117,9 +126,13 @@ class HostStatCollector(StatCollector):
     def _read_cpus():
         cpus = 0
         try:
-            cpus = cpu_count()
-        except Exception:
-            logger.error('multiprocessing does not support cpu_count')
+            # a single sysconf call, without going through multiprocessing
+            cpus = os.sysconf('SC_NPROCESSORS_ONLN')
+        except (ValueError, OSError):
+            try:
+                cpus = cpu_count()
+            except Exception:
+                logger.error('multiprocessing does not support cpu_count')
         return {'cores': cpus}
 
     @staticmethod
@@ -129,28 +142,26 @@ class HostStatCollector(StatCollector):
         return '{0} {1}'.format(row[0], row[2])
 
     def _read_uptime(self):
-        fp = None
-        raw_result = []
-        try:
-            fp = open(HostStatCollector.UPTIME_FILE, 'rU')
-            raw_result = fp.read().split()
-        except Exception:
-            logger.error('Unable to read uptime from {0}'.format(HostStatCollector.UPTIME_FILE))
-        finally:
-            fp and fp.close()
-        return self._transform_input(raw_result, self.transform_uptime_data)
+        now = time.time()
+        if self.uptime is None or not 0 <= now - self.uptime_read_time < self.UPTIME_REREAD_INTERVAL:
+            self.uptime = None
+            try:
+                self.uptime = float(read_small_file(HostStatCollector.UPTIME_FILE).split()[0])
+                self.uptime_read_time = now
+            except Exception:
+                logger.error('Unable to read uptime from {0}'.format(HostStatCollector.UPTIME_FILE))
+        raw_result = [] if self.uptime is None else [self.uptime + now - self.uptime_read_time]
+        return self._transform_list(raw_result, self.transform_uptime_data)
 
     @staticmethod
     def _uptime_to_str(uptime):
         return str(timedelta(seconds=int(float(uptime))))
 
-    @staticmethod
-    def _read_hostname():
-        return {'hostname': socket.gethostname()}
+    def _read_hostname(self):
+        return self.hostname
 
     def _read_uname(self):
-        uname_row = os.uname()
-        return self._transform_input(uname_row, self.transform_uname_data)
+        return self.uname
 
     def output(self, method):
         return super(self.__class__, self).output(method, before_string='Host statistics', after_string='\n')
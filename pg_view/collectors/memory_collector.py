@@ -1,14 +1,18 @@
 from pg_view.collectors.base_collector import StatCollector
 from pg_view.loggers import logger
+from pg_view.utils import ProcFile
 
 
 class MemoryStatCollector(StatCollector):
     """ Collect memory-related statistics """
 
     MEMORY_STAT_FILE = '/proc/meminfo'
+    # values are expected in kB, these are the factors for the other units
+    UNIT_MULTIPLIERS = {'mB': 1000, 'gB': 1000000}
 
     def __init__(self):
         super(MemoryStatCollector, self).__init__(produce_diffs=False)
+        self.memory_stat_file = ProcFile(MemoryStatCollector.MEMORY_STAT_FILE)
         self.transform_dict_data = [
             {'in': 'MemTotal', 'out': 'total', 'fn': int},
             {'in': 'MemFree', 'out': 'free', 'fn': int},
@@ -32,12 +36,6 @@ class MemoryStatCollector(StatCollector):
                 'fn': int,
                 'optional': True,
             },
-            {
-                'infn': self.calculate_kb_left_until_limit,
-                'out': 'commit_left',
-                'fn': int,
-                'optional': True,
-            },
         ]
 
         self.output_transform_data = [
@@ -114,27 +112,25 @@ class MemoryStatCollector(StatCollector):
         """ Read statistics from /proc/meminfo """
 
         memdata = self._read_memory_data()
-        raw_result = self._transform_input(memdata)
+        raw_result = self._transform_dict(memdata)
+        # derived from the already converted values, instead of parsing them once more
+        raw_result['commit_left'] = self.calculate_kb_left_until_limit(raw_result)
         self._do_refresh([raw_result])
 
-    @staticmethod
-    def _read_memory_data():
+    def _read_memory_data(self):
         """ Read relevant data from /proc/meminfo. We are interesed in the following fields:
             MemTotal, MemFree, Buffers, Cached, Dirty, CommitLimit, Committed_AS
         """
         result = {}
         try:
-            fp = open(MemoryStatCollector.MEMORY_STAT_FILE, 'rU')
-            for line in fp:
-                vals = line.strip().split()
+            data = self.memory_stat_file.read().decode('utf-8', 'replace')
+            for line in data.splitlines():
+                vals = line.split()
                 if len(vals) >= 2:
                     name, val = vals[:2]
                     # if we have units of measurement different from kB - transform the result
-                    if len(vals) == 3 and vals[2] in ('mB', 'gB'):
-                        if vals[2] == 'mB':
-                            val += '0' * 3
-                        if vals[2] == 'gB':
-                            val += '0' * 6
+                    if len(vals) == 3 and vals[2] in MemoryStatCollector.UNIT_MULTIPLIERS:
+                        val = int(val) * MemoryStatCollector.UNIT_MULTIPLIERS[vals[2]]
                     if len(str(name)) > 1:
                         result[str(name)[:-1]] = val
                     else:
@@ -143,17 +139,14 @@ class MemoryStatCollector(StatCollector):
                     logger.error('/proc/meminfo string is not name value: {0}'.format(vals))
         except Exception:
             logger.error('Unable to read /proc/meminfo memory statistics. Check your permissions')
-            return result
-        finally:
-            fp.close()
         return result
 
-    def calculate_kb_left_until_limit(self, colname, row, optional):
-        result = (int(row['CommitLimit']) - int(row['Committed_AS']) if row.get('CommitLimit', None) is not None and
-                  row.get('Committed_AS', None) is not None else None)
-        if result is None and not optional:
-            self.warn_non_optional_column(colname)
-        return result
+    @staticmethod
+    def calculate_kb_left_until_limit(row):
+        # both source columns are optional, so is the result
+        if row.get('commit_limit') is None or row.get('committed_as') is None:
+            return None
+        return row['commit_limit'] - row['committed_as']
 
     def output(self, method):
         return super(self.__class__, self).output(method, before_string='Memory statistics:', after_string='\n')
@@ -2,13 +2,13 @@ import glob
 import os
 import sys
 import time
-from multiprocessing import Process
+from threading import Thread
 
 from pg_view.collectors.base_collector import StatCollector
 from pg_view import consts
 from pg_view.loggers import logger
 from pg_view.models.outputs import COLALIGN
-from pg_view.utils import BLOCK_SIZE
+from pg_view.utils import BLOCK_SIZE, ProcFile
 
 if sys.hexversion >= 0x03000000:
     long = int
@@ -28,6 +28,7 @@ class PartitionStatCollector(StatCollector):
         self.dbver = dbversion
         self.queue_consumer = consumer
         self.work_directory = work_directory
+        self.disk_stat_file = ProcFile(PartitionStatCollector.DISK_STAT_FILE)
         self.df_list_transformation = [{'out': 'dev', 'in': 0, 'fn': self._dereference_dev_name},
                                        {'out': 'space_total', 'in': 1, 'fn': int},
                                        {'out': 'space_left', 'in': 2, 'fn': int}]
@@ -128,6 +129,10 @@ class PartitionStatCollector(StatCollector):
         self.ncurses_custom_fields = {'header': True,
                                       'prefix': None}
         self.postinit()
+        # the df, diskstats and du rows have fixed layouts, resolve their transformations once
+        self.transform_df = self._compile_transformation(self.df_list_transformation, positional=True)
+        self.transform_io = self._compile_transformation(self.io_list_transformation, positional=True)
+        self.transform_du = self._compile_transformation(self.du_list_transformation, positional=True)
 
     def ident(self):
         return '{0} ({1}/{2})'.format(super(PartitionStatCollector, self).ident(), self.dbname, self.dbver)
@@ -147,16 +152,16 @@ class PartitionStatCollector(StatCollector):
             (du_out, df_out) = queue_data
 
         for pname in PartitionStatCollector.DATA_NAME, PartitionStatCollector.XLOG_NAME:
-            result[pname] = self._transform_input(df_out[pname], self.df_list_transformation)
+            result[pname] = self.transform_df(df_out[pname])
 
         io_out = self.get_io_data([result[PartitionStatCollector.DATA_NAME]['dev'],
                                    result[PartitionStatCollector.XLOG_NAME]['dev']])
 
         for pname in PartitionStatCollector.DATA_NAME, PartitionStatCollector.XLOG_NAME:
             if result[pname]['dev'] in io_out:
-                result[pname].update(self._transform_input(io_out[result[pname]['dev']], self.io_list_transformation))
+                result[pname].update(self.transform_io(io_out[result[pname]['dev']]))
             if pname in du_out:
-                result[pname].update(self._transform_input(du_out[pname], self.du_list_transformation))
+                result[pname].update(self.transform_du(du_out[pname]))
             # set the type manually
             result[pname]['type'] = pname
 
@@ -172,43 +177,41 @@ class PartitionStatCollector(StatCollector):
             return cur['space_left'] / (prev['path_size'] - cur['path_size'])
         return None
 
-    @staticmethod
-    def get_io_data(pnames):
+    def get_io_data(self, pnames):
         """ Retrieve raw data from /proc/diskstat (transformations are perfromed via io_list_transformation)"""
         result = {}
-        found = 0  # stop if we found records for all partitions
-        total = len(pnames)
+        # data and xlog may reside on the same device
+        pnames = set(pnames)
         try:
-            fp = None
-            fp = open(PartitionStatCollector.DISK_STAT_FILE, 'rU')
-            for line in fp:
+            data = self.disk_stat_file.read().decode('utf-8', 'replace')
+            for line in data.splitlines():
                 elements = line.split()
-                for pname in pnames:
-                    if pname in elements:
-                        result[pname] = elements
-                        found += 1
-                        if found == total:
-                            break
-                if found == total:
-                    break
+                # the device name is the 3rd field, after the major and minor numbers
+                if len(elements) > 2 and elements[2] in pnames:
+                    result[elements[2]] = elements
+                    # stop if we found records for all partitions
+                    if len(result) == len(pnames):
+                        break
         except Exception:
             logger.error('Unable to read {0}'.format(PartitionStatCollector.DISK_STAT_FILE))
             result = {}
-        finally:
-            fp and fp.close()
         return result
 
     def output(self, method):
         return super(self.__class__, self).output(method, before_string='PostgreSQL partitions:', after_string='\n')
 
 
-class DetachedDiskStatCollector(Process):
-    """ This class runs in a separate process and runs du and df """
+class DetachedDiskStatCollector(Thread):
+    """ This class runs in a separate thread and runs du and df.
+
+        The work consists mostly of stat and statvfs system calls, which release the GIL.
+    """
 
     OLD_WAL_SUBDIR = '/pg_xlog/'
     WAL_SUBDIR = '/pg_wal/'
 
     NEW_WAL_SINCE = 10.0
+    DF_REREAD_INTERVAL = 10  # seconds between statvfs calls for the same device
 
     def __init__(self, q, work_directories, db_version):
         super(DetachedDiskStatCollector, self).__init__()
@@ -216,7 +219,13 @@ class DetachedDiskStatCollector(Process):
         self.q = q
         self.daemon = True
         self.db_version = db_version
+        # device -> (time of the statvfs call, its result), shared by the clusters on the same device
         self.df_cache = {}
+        # mount point -> device and device mapper name -> block device, read once per pass
+        self.mounted_devices = None
+        self.mapper_devices = None
+        # path -> mount point of its filesystem, kept until the mounts change
+        self.mount_points = {}
 
     @property
     def wal_directory(self):
@@ -233,7 +242,11 @@ class DetachedDiskStatCollector(Process):
             # wait until the previous data is consumed
             self.q.join()
             result = {}
-            self.df_cache = {}
+            mounted_devices = self._read_mounted_devices()
+            if mounted_devices != self.mounted_devices:
+                self.mount_points = {}
+            self.mounted_devices = mounted_devices
+            self.mapper_devices = None
             for wd in self.work_directories:
                 du_data = self.get_du_data(wd)
                 df_data = self.get_df_data(wd)
@@ -247,8 +260,12 @@ class DetachedDiskStatCollector(Process):
 
         result = {'data': [], 'xlog': []}
         try:
-            data_size = self.run_du(wd, BLOCK_SIZE)
-            xlog_size = self.run_du(wd + self.wal_directory, BLOCK_SIZE)
+            # the WAL directory is usually a plain subdirectory, measure it while walking the data directory
+            data_size, xlog_size = self.run_du_with_subdir(wd, os.path.join(wd, self.wal_directory.strip('/')),
+                                                           BLOCK_SIZE)
+            if xlog_size is None:
+                # it's a symlink or a mount point, walk it separately
+                xlog_size = self.run_du(wd + self.wal_directory, BLOCK_SIZE)
         except Exception as e:
             logger.error('Unable to read free space information for the pg_xlog and data directories for the directory\
              {0}: {1}'.format(wd, e))
@@ -259,31 +276,67 @@ class DetachedDiskStatCollector(Process):
         return result
 
     @staticmethod
-    def run_du(pathname, block_size=BLOCK_SIZE, exclude=['lost+found']):
+    def run_du(pathname, block_size=BLOCK_SIZE, exclude=frozenset(['lost+found'])):
+        return DetachedDiskStatCollector.run_du_with_subdir(pathname, None, block_size, exclude)[0]
+
+    @staticmethod
+    def run_du_with_subdir(pathname, subdir, block_size=BLOCK_SIZE, exclude=frozenset(['lost+found'])):
+        """ Calculate the size of pathname and of the subdir directory within it in a single walk.
+
+            The size of subdir is None if it's not a directory on the same partition as pathname.
+        """
         size = 0
-        folders = [pathname]
+        subdir_size = 0
+        subdir_found = False
+        # (directory, whether it is inside subdir)
+        folders = [(pathname, False)]
         root_dev = os.lstat(pathname).st_dev
         while len(folders):
-            c = folders.pop()
-            for e in os.listdir(c):
-                e = os.path.join(c, e)
-                try:
-                    st = os.lstat(e)
-                except os.error:
-                    # don't care about files removed while we are trying to read them.
-                    continue
+            c, in_subdir = folders.pop()
+            for name, e, st in DetachedDiskStatCollector._scan_directory(c):
                 # skip data on different partition
                 if st.st_dev != root_dev:
                     continue
                 mode = st.st_mode & 0xf000  # S_IFMT
                 if mode == 0x4000:  # S_IFDIR
-                    if e in exclude:
+                    if name in exclude:
                         continue
-                    folders.append(e)
-                    size += st.st_size
+                    if e == subdir:
+                        # the subdir itself is not part of its size, only its contents are
+                        subdir_found = True
+                        folders.append((e, True))
+                    else:
+                        folders.append((e, in_subdir))
+                        if in_subdir:
+                            subdir_size += st.st_blocks
+                    size += st.st_blocks
                 if mode == 0x8000:  # S_IFREG
-                    size += st.st_size
-        return long(size / block_size)
+                    size += st.st_blocks
+                    if in_subdir:
+                        subdir_size += st.st_blocks
+        # count the space allocated on disk like du does, st_blocks is in 512-byte units
+        return long(size * 512 / block_size), long(subdir_size * 512 / block_size) if subdir_found else None
+
+    @staticmethod
+    def _scan_directory(pathname):
+        """ yield name, path and lstat result for the directories and regular files in pathname """
+        if not hasattr(os, 'scandir'):
+            # Python 2, stat every entry
+            for name in os.listdir(pathname):
+                e = os.path.join(pathname, name)
+                try:
+                    yield name, e, os.lstat(e)
+                except os.error:
+                    # don't care about files removed while we are trying to read them.
+                    continue
+            return
+        for entry in os.scandir(pathname):
+            # the entry type comes with the directory listing, no need to stat symlinks, sockets and so on
+            if entry.is_dir(follow_symlinks=False) or entry.is_file(follow_symlinks=False):
+                try:
+                    yield entry.name, entry.path, entry.stat(follow_symlinks=False)
+                except os.error:
+                    continue
 
     def get_df_data(self, work_directory):
         """ Retrive raw data from df (transformations are performed via df_list_transformation) """
@@ -292,17 +345,9 @@ class DetachedDiskStatCollector(Process):
         # obtain the device names
         data_dev = self.get_mounted_device(self.get_mount_point(work_directory))
         xlog_dev = self.get_mounted_device(self.get_mount_point(work_directory + self.wal_directory))
-        if data_dev not in self.df_cache:
-            data_vfs = os.statvfs(work_directory)
-            self.df_cache[data_dev] = data_vfs
-        else:
-            data_vfs = self.df_cache[data_dev]
-
-        if xlog_dev not in self.df_cache:
-            xlog_vfs = os.statvfs(work_directory + self.wal_directory)
-            self.df_cache[xlog_dev] = xlog_vfs
-        else:
-            xlog_vfs = self.df_cache[xlog_dev]
+        now = time.time()
+        data_vfs = self._get_statvfs(data_dev, work_directory, now)
+        xlog_vfs = self._get_statvfs(xlog_dev, work_directory + self.wal_directory, now)
 
         result['data'] = (data_dev, data_vfs.f_blocks * (data_vfs.f_bsize / BLOCK_SIZE),
                           data_vfs.f_bavail * (data_vfs.f_bsize / BLOCK_SIZE))
@@ -313,46 +358,72 @@ class DetachedDiskStatCollector(Process):
             result['xlog'] = result['data']
         return result
 
-    @staticmethod
-    def get_mounted_device(pathname):
+    def _get_statvfs(self, device, pathname, now):
+        """ statvfs pathname, unless we did it for the same device recently """
+        cached = self.df_cache.get(device)
+        if cached is None or not 0 <= now - cached[0] < self.DF_REREAD_INTERVAL:
+            cached = self.df_cache[device] = (now, os.statvfs(pathname))
+        return cached[1]
+
+    def get_mounted_device(self, pathname):
         """Get the device mounted at pathname"""
 
-        # uses "/proc/mounts"
-        raw_dev_name = None
-        dev_name = None
+        if self.mounted_devices is None:
+            self.mounted_devices = self._read_mounted_devices()
         pathname = os.path.normcase(pathname)  # might be unnecessary here
+        raw_dev_name = dev_name = self.mounted_devices.get(pathname)
+        if raw_dev_name is not None and raw_dev_name[:11] == '/dev/mapper':
+            if self.mapper_devices is None:
+                self.mapper_devices = self._read_mapper_devices()
+            dev_name = self.mapper_devices.get(raw_dev_name[12:], dev_name)
+        return dev_name
+
+    @staticmethod
+    def _read_mounted_devices():
+        """ map the mount points to the devices mounted there, using "/proc/mounts" """
+        result = {}
         try:
             with open('/proc/mounts', 'r') as ifp:
                 for line in ifp:
                     fields = line.rstrip('\n').split()
                     # note that line above assumes that
                     # no mount points contain whitespace
-                    if fields[1] == pathname and (fields[0])[:5] == '/dev/':
-                        raw_dev_name = dev_name = fields[0]
-                        break
+                    if fields[0][:5] == '/dev/':
+                        # the first matching line wins
+                        result.setdefault(fields[1], fields[0])
         except EnvironmentError:
             pass
-        if raw_dev_name is not None and raw_dev_name[:11] == '/dev/mapper':
-            # we have to read the /sys/block/*/*/name and match with the rest of the device
-            for fname in glob.glob('/sys/block/*/*/name'):
-                try:
-                    with open(fname) as f:
-                        block_dev_name = f.read().strip()
-                except IOError:
-                    # ignore those files we couldn't read (lack of permissions)
-                    continue
-                if raw_dev_name[12:] == block_dev_name:
-                    # we found the proper device name, get the 3rd comonent of the path
-                    # i.e. /sys/block/dm-0/dm/name
-                    components = fname.split('/')
-                    if len(components) >= 4:
-                        dev_name = components[3]
-                    break
-        return dev_name
+        return result
+
+    @staticmethod
+    def _read_mapper_devices():
+        """ map the device mapper names to the block devices, i.e. vg-data -> dm-0 """
+        result = {}
+        # we have to read the /sys/block/*/*/name and match with the rest of the device
+        for fname in glob.glob('/sys/block/*/*/name'):
+            try:
+                with open(fname) as f:
+                    block_dev_name = f.read().strip()
+            except IOError:
+                # ignore those files we couldn't read (lack of permissions)
+                continue
+            # get the 3rd comonent of the path, i.e. /sys/block/dm-0/dm/name
+            components = fname.split('/')
+            if len(components) >= 4:
+                result.setdefault(block_dev_name, components[3])
+        return result
+
+    def get_mount_point(self, pathname):
+        """Get the mount point of the filesystem containing pathname"""
+
+        mount_point = self.mount_points.get(pathname)
+        if mount_point is None:
+            mount_point = self.mount_points[pathname] = self._find_mount_point(pathname)
+        return mount_point
 
     @staticmethod
-    def get_mount_point(pathname):
-        """Get the mounlst point of the filesystem containing pathname"""
+    def _find_mount_point(pathname):
+        """ walk up from pathname until the parent directory is on a different device """
 
         pathname = os.path.normcase(os.path.realpath(pathname))
         parent_device = path_device = os.stat(pathname).st_dev
@@ -1,12 +1,16 @@
+import errno
+import os
 import re
 import sys
+import time
+from multiprocessing.pool import ThreadPool
 
 import psycopg2
 
 from pg_view.collectors.base_collector import StatCollector
 from pg_view.loggers import logger
 from pg_view.models.outputs import COLSTATUS, COLALIGN
-from pg_view.utils import MEM_PAGE_SIZE, dbversion_as_float
+from pg_view.utils import MEM_PAGE_SIZE, dbversion_as_float, proc_data_to_str, read_small_file, split_proc_stat
 
 if sys.hexversion >= 0x03000000:
     long = int
@@ -18,7 +22,24 @@ else:
 class PgstatCollector(StatCollector):
     """ Collect PostgreSQL-related statistics """
 
+    PROC_DIR = '/proc'
+    STAT_FILENAME = '/proc/{0}/stat'
+    CMDLINE_FILENAME = '/proc/{0}/cmdline'
+    IO_FILENAME = '/proc/{0}/io'
     STATM_FILENAME = '/proc/{0}/statm'
+    # postgres: stats collector process
+    PSINFO_RE = re.compile(r'postgres:\s+(.*)\s+process\s*(.*)$')
+    PSINFO_BACKEND_RE = re.compile(r'postgres:')
+    IDLE_IN_TRANSACTION_RE = re.compile(r'idle in transaction (\d+)')
+    # any run of whitespace, including line breaks, is shown as a single space in the query column
+    QUERY_WHITESPACE_RE = re.compile(r'\s+')
+    # the role only changes on promotion, no need to ask for it on every refresh
+    RECOVERY_STATUS_TTL = 30
+    # name of the per-connection prepared pg_stat_activity statement
+    ACTIVITY_STATEMENT = 'pg_view_activity'
+    # /proc reads are spread over a few threads, but only for clusters with enough processes to gain from it
+    PROC_READER_THREADS = 8
+    PROC_READER_MIN_PIDS = 16
 
     def __init__(self, pgcon, reconnect, pid, dbname, dbver, always_track_pids):
         super(PgstatCollector, self).__init__()
@@ -26,13 +47,21 @@ class PgstatCollector(StatCollector):
         self.pgcon = pgcon
         self.reconnect = reconnect
         self.pids = []
+        self._stat_cache = {}
+        # created on the first refresh that needs it and reused afterwards
+        self._proc_reader_pool = None
+        # column names of the pg_stat_activity rows, set when the rows are read
+        self.activity_columns = []
         self.rows_diff = []
         self.rows_diff_output = []
         # figure out our backend pid
         self.connection_pid = pgcon.get_backend_pid()
         self.max_connections = self._get_max_connections()
         self.recovery_status = self._get_recovery_status()
-        self.always_track_pids = always_track_pids
+        self.recovery_status_checked_at = time.time()
+        self.activity_statement_prepared = False
+        # pids are only checked for membership, once per process on every refresh
+        self.always_track_pids = frozenset(always_track_pids)
         self.dbname = dbname
         self.dbver = dbver
         self.server_version = pgcon.get_parameter_status('server_version')
@@ -63,6 +92,9 @@ class PgstatCollector(StatCollector):
             },
         ]
 
+        # the fields past the last one we transform are never looked at, leave them unsplit
+        self.stat_maxsplit = max(col['in'] for col in self.transform_list_data) + 1
+
         self.transform_dict_data = [{'out': 'read_bytes', 'fn': int, 'optional': True}, {'out': 'write_bytes',
                                                                                          'fn': int, 'optional': True}]
 
@@ -212,22 +244,49 @@ class PgstatCollector(StatCollector):
                                       'prefix': None}
 
         self.postinit()
+        # query_status_fn also needs to know whether the process is waiting on a lock
+        self.output_transform_data[self.output_column_positions['query']]['_wpos'] = self.output_column_positions['w']
 
     def get_subprocesses_pid(self):
-        ppid = self.postmaster_pid
-        result = self.exec_command_with_output('ps -o pid --ppid {0} --noheaders'.format(ppid))
-        if result[0] != 0:
-            logger.info("Couldn't determine the pid of subprocesses for {0}".format(ppid))
+        """ find children of the postmaster by scanning /proc/[pid]/stat """
+        # keep the stat contents of the children around, _read_proc parses them later in the same refresh
+        self._stat_cache = {}
+        if self.postmaster_pid is None:
+            # postmaster.pid was not readable when we (re)connected
+            self.pids = []
+            return
+        ppid = int(self.postmaster_pid)
+        pids = []
+        try:
+            entries = os.listdir(self.PROC_DIR)
+        except OSError as e:
+            logger.info("Couldn't determine the pid of subprocesses for {0}: {1}".format(ppid, e))
             self.pids = []
-        self.pids = [int(x) for x in result[1].split()]
+            return
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            try:
+                stat = read_small_file(self.STAT_FILENAME.format(entry))
+            except OSError:
+                # the process is already gone
+                continue
+            # the process name might contain spaces and parentheses, skip past it: the state goes first, then ppid
+            fields = stat[stat.rfind(b')') + 1:].split(None, 2)
+            if len(fields) > 1 and int(fields[1]) == ppid:
+                pid = int(entry)
+                pids.append(pid)
+                self._stat_cache[pid] = stat
+        pids.sort()
+        self.pids = pids
 
     def check_ps_state(self, row, col):
-        if row[self.output_column_positions[col['out']]] == col.get('warning', ''):
+        if row[col['_pos']] == col.get('warning', ''):
             return {0: COLSTATUS.cs_warning}
         return {0: COLSTATUS.cs_ok}
 
     def age_status_fn(self, row, col):
-        age_string = row[self.output_column_positions[col['out']]]
+        age_string = row[col['_pos']]
         age_seconds = self.time_field_to_seconds(age_string)
         if 'critical' in col and col['critical'] < age_seconds:
             return {-1: COLSTATUS.cs_critical}
@@ -236,7 +295,7 @@ class PgstatCollector(StatCollector):
         return {-1: COLSTATUS.cs_ok}
 
     def idle_format_fn(self, text):
-        r = re.match(r'idle in transaction (\d+)', text)
+        r = self.IDLE_IN_TRANSACTION_RE.match(text)
         if not r:
             return text
         else:
@@ -247,10 +306,10 @@ class PgstatCollector(StatCollector):
                        + ' since the last query start'
 
     def query_status_fn(self, row, col):
-        if row[self.output_column_positions['w']] is True:
+        if row[col['_wpos']] is True:
             return {-1: COLSTATUS.cs_critical}
         else:
-            val = row[self.output_column_positions[col['out']]]
+            val = row[col['_pos']]
             if val and val.startswith(col.get('warning', '!')):
                 return {-1: COLSTATUS.cs_warning}
         return {-1: COLSTATUS.cs_ok}
@@ -264,13 +323,12 @@ class PgstatCollector(StatCollector):
         pstype = 'unknown'
         action = None
         if cmdline is not None and len(cmdline) > 0:
-            # postgres: stats collector process
-            m = re.match(r'postgres:\s+(.*)\s+process\s*(.*)$', cmdline)
+            m = PgstatCollector.PSINFO_RE.match(cmdline)
             if m:
                 pstype = m.group(1)
                 action = m.group(2)
             else:
-                if re.match(r'postgres:.*', cmdline):
+                if PgstatCollector.PSINFO_BACKEND_RE.match(cmdline):
                     # assume it's a backend process
                     pstype = 'backend'
         if pstype == 'autovacuum worker':
@@ -296,6 +354,10 @@ class PgstatCollector(StatCollector):
     def refresh(self):
         """ Reads data from /proc and PostgreSQL stats """
         result = []
+        if self.postmaster_pid is None and self.pgcon:
+            # reconnect below reads postmaster.pid again, i.e. after the server has been restarted
+            self.pgcon.close()
+            self.pgcon = None
         # fetch up-to-date list of subprocess PIDs
         self.get_subprocesses_pid()
         try:
@@ -305,6 +367,8 @@ class PgstatCollector(StatCollector):
                 self.pgcon, self.postmaster_pid = self.reconnect()
                 self.connection_pid = self.pgcon.get_backend_pid()
                 self.max_connections = self._get_max_connections()
+                self.recovery_status_checked_at = 0
+                self.activity_statement_prepared = False
                 self.dbver = dbversion_as_float(self.pgcon)
                 self.server_version = self.pgcon.get_parameter_status('server_version')
             stat_data = self._read_pg_stat_activity()
@@ -313,63 +377,78 @@ class PgstatCollector(StatCollector):
             if self.pgcon and not self.pgcon.closed:
                 self.pgcon.close()
             self.pgcon = None
+            self._stat_cache = {}
             self._do_refresh([])
             return
         logger.info("new refresh round")
-        for pid in self.pids:
-            if pid == self.connection_pid:
-                continue
-            is_backend = pid in stat_data
-            is_active = is_backend and (stat_data[pid]['query'] != 'idle' or pid in self.always_track_pids)
+        query_idx = self.activity_columns.index('query')
+        pids = [pid for pid in self.pids if pid != self.connection_pid]
+        # memory usage is only shown for the auxiliary processes and the non-idle backends,
+        # collect it in one go for those processes only.
+        memory_usage = dict((pid, self._get_memory_usage(pid)) for pid in pids
+                            if pid not in stat_data or stat_data[pid][query_idx] != 'idle' or
+                            pid in self.always_track_pids)
+        # for each pid, get hash row from /proc/
+        proc_rows = self._read_procs(pids, stat_data, memory_usage)
+        for pid, proc_data in zip(pids, proc_rows):
             result_row = {}
-            # for each pid, get hash row from /proc/
-            proc_data = self._read_proc(pid, is_backend, is_active)
             if proc_data:
                 result_row.update(proc_data)
             if stat_data and pid in stat_data:
                 # ditto for the pg_stat_activity
-                result_row.update(stat_data[pid])
+                result_row.update(zip(self.activity_columns, stat_data[pid]))
             # result is not empty - add it to the list of current rows
             if result_row:
                 result.append(result_row)
+        self._stat_cache = {}
         # and refresh the rows with this data
         self._do_refresh(result)
 
-    def _read_proc(self, pid, is_backend, is_active):
+    def _read_procs(self, pids, stat_data, memory_usage):
+        """ Call _read_proc for every pid, returning the results in the order of pids """
+        args = [(pid, pid in stat_data, memory_usage.get(pid)) for pid in pids]
+        if len(args) < self.PROC_READER_MIN_PIDS:
+            return [self._read_proc(*a) for a in args]
+        # the GIL is released while waiting for the kernel, so the reads of different pids overlap
+        if self._proc_reader_pool is None:
+            self._proc_reader_pool = ThreadPool(self.PROC_READER_THREADS)
+        return self._proc_reader_pool.map(lambda a: self._read_proc(*a), args)
+
+    def _read_proc(self, pid, is_backend, uss=None):
         """ see man 5 proc for details (/proc/[pid]/stat) """
         result = {}
         raw_result = {}
 
-        fp = None
         # read raw data from /proc/stat, proc/cmdline and /proc/io
-        for ftyp, fname in zip(('stat', 'cmd', 'io',), ('/proc/{0}/stat', '/proc/{0}/cmdline', '/proc/{0}/io')):
-            try:
-                fp = open(fname.format(pid), 'rU')
-                if ftyp == 'stat':
-                    raw_result[ftyp] = fp.read().strip().split()
-                if ftyp == 'cmd':
-                    # large number of trailing \0x00 returned by python
-                    raw_result[ftyp] = fp.readline().strip('\x00').strip()
-                if ftyp == 'io':
-                    proc_stat_io_read = {}
-                    for line in fp:
-                        x = [e.strip(':') for e in line.split()]
-                        if len(x) < 2:
-                            logger.error(
-                                '{0} content not in the "name: value" form: {1}'.format(fname.format(pid), line))
-                            continue
-                        else:
-                            proc_stat_io_read[x[0]] = int(x[1])
-                    raw_result[ftyp] = proc_stat_io_read
-            except IOError:
-                logger.warning('Unable to read {0}, process data will be unavailable'.format(fname.format(pid)))
-                return None
-            finally:
-                fp and fp.close()
+        try:
+            # the stat file is usually read already by get_subprocesses_pid during this refresh
+            stat = self._stat_cache.pop(pid, None)
+            if stat is None:
+                stat = read_small_file(self.STAT_FILENAME.format(pid))
+            cmdline = read_small_file(self.CMDLINE_FILENAME.format(pid))
+            io = read_small_file(self.IO_FILENAME.format(pid))
+        except OSError as e:
+            # processes terminate all the time, there is no need to complain about it
+            if e.errno != errno.ENOENT:
+                logger.warning('Unable to read {0}, process data will be unavailable'.format(e.filename))
+            return None
+        raw_result['stat'] = split_proc_stat(proc_data_to_str(stat), self.stat_maxsplit)
+        # large number of trailing \0x00 returned by python
+        raw_result['cmd'] = proc_data_to_str(cmdline).strip('\x00').strip()
+        proc_stat_io_read = {}
+        for line in proc_data_to_str(io).splitlines():
+            x = [e.strip(':') for e in line.split()]
+            if len(x) < 2:
+                logger.error(
+                    '{0} content not in the "name: value" form: {1}'.format(self.IO_FILENAME.format(pid), line))
+                continue
+            else:
+                proc_stat_io_read[x[0]] = int(x[1])
+        raw_result['io'] = proc_stat_io_read
 
         # Assume we managed to read the row if we can get its PID
-        for cat in 'stat', 'io':
-            result.update(self._transform_input(raw_result.get(cat, {} if cat == 'io' else [])))
+        result.update(self._transform_list(raw_result.get('stat', [])))
+        result.update(self._transform_dict(raw_result.get('io', {})))
         # generated columns
         result['cmdline'] = raw_result.get('cmd', None)
         if not is_backend:
@@ -378,8 +457,8 @@ class PgstatCollector(StatCollector):
                 result['query'] = action
         else:
             result['type'] = 'backend'
-        if is_active or not is_backend:
-            result['uss'] = self._get_memory_usage(pid)
+        if uss is not None:
+            result['uss'] = uss
         return result
 
     def _get_memory_usage(self, pid):
@@ -394,17 +473,16 @@ class PgstatCollector(StatCollector):
         # while providing slightly outdated results.
         uss = 0
         statm = None
-        fp = None
         try:
-            fp = open(self.STATM_FILENAME.format(pid), 'r')
-            statm = fp.read().strip().split()
+            # only size, resident and shared are needed, leave the rest of the fields unsplit
+            statm = read_small_file(self.STATM_FILENAME.format(pid)).split(None, 3)
             logger.info("calculating memory for process {0}".format(pid))
-        except IOError as e:
-            logger.warning(
-                'Unable to read {0}: {1}, process memory information will be unavailable'.format(
-                    self.STATM_FILENAME.format(pid), e))
-        finally:
-            fp and fp.close()
+        except OSError as e:
+            # the process might have exited after we have listed the children of the postmaster
+            if e.errno != errno.ENOENT:
+                logger.warning(
+                    'Unable to read {0}: {1}, process memory information will be unavailable'.format(
+                        self.STATM_FILENAME.format(pid), e))
         if statm and len(statm) >= 3:
             uss = (long(statm[1]) - long(statm[2])) * MEM_PAGE_SIZE
         return uss
@@ -412,31 +490,64 @@ class PgstatCollector(StatCollector):
     def _get_max_connections(self):
         """ Read max connections from the database """
 
-        cur = self.pgcon.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur = self.pgcon.cursor()
         cur.execute('show max_connections')
         result = cur.fetchone()
         cur.close()
-        return int(result.get('max_connections', 0))
+        return int(result[0]) if result else 0
 
     def _get_recovery_status(self):
         """ Determine whether the Postgres process is in recovery """
 
-        cur = self.pgcon.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur = self.pgcon.cursor()
         cur.execute("select case when pg_is_in_recovery() then 'standby' else 'master' end as role")
         result = cur.fetchone()
         cur.close()
-        return result.get('role', 'unknown')
-
-    def _read_pg_stat_activity(self):
-        """ Read data from pg_stat_activity """
-
-        self.recovery_status = self._get_recovery_status()
-        cur = self.pgcon.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
+        return result[0] if result else 'unknown'
+
+    def _refresh_recovery_status(self):
+        """ Re-read the recovery status once it is older than RECOVERY_STATUS_TTL """
+
+        now = time.time()
+        if now - self.recovery_status_checked_at >= self.RECOVERY_STATUS_TTL:
+            self.recovery_status = self._get_recovery_status()
+            self.recovery_status_checked_at = now
+
+    def _get_activity_query(self):
+        """ Return the pg_stat_activity query matching the server version """
+
+        # before 9.6 the blockers are found by matching the ungranted locks against the granted ones.
+        # Doing it once in a CTE restricts the self-join to the waiting locks only, instead of
+        # joining pg_locks twice for every row of pg_stat_activity and grouping the result back.
+        # Which lock tag columns are set depends only on the locktype, so comparing them with
+        # coalesce() defaults never matches a NULL against a real value. Unlike IS NOT DISTINCT FROM,
+        # these are plain equalities the planner can hash, instead of comparing every pair of locks.
+        blockers_cte = """
+                    WITH blockers AS (
+                        SELECT this.pid,
+                               array_to_string(array_agg(DISTINCT other.pid ORDER BY other.pid), ',') AS locked_by
+                          FROM pg_locks this
+                          JOIN pg_locks other ON this.locktype = other.locktype
+                                             AND coalesce(this.database, 0) = coalesce(other.database, 0)
+                                             AND coalesce(this.relation, 0) = coalesce(other.relation, 0)
+                                             AND coalesce(this.page, -1) = coalesce(other.page, -1)
+                                             AND coalesce(this.tuple, -1) = coalesce(other.tuple, -1)
+                                             AND coalesce(this.virtualxid, '') = coalesce(other.virtualxid, '')
+                                             AND coalesce(this.transactionid::text, '') =
+                                                 coalesce(other.transactionid::text, '')
+                                             AND coalesce(this.classid, 0) = coalesce(other.classid, 0)
+                                             AND coalesce(this.objid, 0) = coalesce(other.objid, 0)
+                                             AND coalesce(this.objsubid, -1) = coalesce(other.objsubid, -1)
+                                             AND this.pid != other.pid
+                                             AND other.granted = 't'
+                         WHERE this.granted = 'f'
+                         GROUP BY this.pid
+                    )
+        """
         # the pg_stat_activity format has been changed to 9.2, avoiding ambigiuous meanings for some columns.
         # since it makes more sense then the previous layout, we 'cast' the former versions to 9.2
         if self.dbver < 9.2:
-            cur.execute("""
+            return blockers_cte + """
                     SELECT datname,
                            procpid as pid,
                            usename,
@@ -444,8 +555,7 @@ class PgstatCollector(StatCollector):
                            client_port,
                            round(extract(epoch from (now() - xact_start))) as age,
                            waiting,
-                           NULLIF(array_to_string(array_agg(DISTINCT other.pid ORDER BY other.pid), ','), '')
-                                as locked_by,
+                           NULLIF(b.locked_by, '') AS locked_by,
                            CASE WHEN current_query = '<IDLE> in transaction' THEN
                                     CASE WHEN xact_start != query_start THEN
                                              'idle in transaction ' || CAST(
@@ -457,24 +567,11 @@ class PgstatCollector(StatCollector):
                                 ELSE current_query
                            END AS query
                       FROM pg_stat_activity a
-                      LEFT JOIN pg_locks  this ON (this.pid = procpid and this.granted = 'f')
-                      LEFT JOIN pg_locks other ON this.locktype = other.locktype
-                                               AND this.database IS NOT DISTINCT FROM other.database
-                                               AND this.relation IS NOT DISTINCT FROM other.relation
-                                               AND this.page IS NOT DISTINCT FROM other.page
-                                               AND this.tuple IS NOT DISTINCT FROM other.tuple
-                                               AND this.virtualxid IS NOT DISTINCT FROM other.virtualxid
-                                               AND this.transactionid IS NOT DISTINCT FROM other.transactionid
-                                               AND this.classid IS NOT DISTINCT FROM other.classid
-                                               AND this.objid IS NOT DISTINCT FROM other.objid
-                                               AND this.objsubid IS NOT DISTINCT FROM other.objsubid
-                                               AND this.pid != other.pid
-                                               AND other.granted = 't'
+                      LEFT JOIN blockers b ON b.pid = procpid
                       WHERE procpid != pg_backend_pid()
-                      GROUP BY 1,2,3,4,5,6,7,9
-                      """)
+                      """
         elif self.dbver < 9.6:
-            cur.execute("""
+            return blockers_cte + """
                     SELECT datname,
                            a.pid as pid,
                            usename,
@@ -482,8 +579,7 @@ class PgstatCollector(StatCollector):
                            client_port,
                            round(extract(epoch from (now() - xact_start))) as age,
                            waiting,
-                           NULLIF(array_to_string(array_agg(DISTINCT other.pid ORDER BY other.pid), ','), '')
-                                as locked_by,
+                           NULLIF(b.locked_by, '') AS locked_by,
                            CASE WHEN state = 'idle in transaction' THEN
                                     CASE WHEN xact_start != state_change THEN
                                              'idle in transaction ' || CAST(
@@ -495,24 +591,11 @@ class PgstatCollector(StatCollector):
                                 ELSE state
                            END AS query
                       FROM pg_stat_activity a
-                      LEFT JOIN pg_locks  this ON (this.pid = a.pid and this.granted = 'f')
-                      LEFT JOIN pg_locks other ON this.locktype = other.locktype
-                                               AND this.database IS NOT DISTINCT FROM other.database
-                                               AND this.relation IS NOT DISTINCT FROM other.relation
-                                               AND this.page IS NOT DISTINCT FROM other.page
-                                               AND this.tuple IS NOT DISTINCT FROM other.tuple
-                                               AND this.virtualxid IS NOT DISTINCT FROM other.virtualxid
-                                               AND this.transactionid IS NOT DISTINCT FROM other.transactionid
-                                               AND this.classid IS NOT DISTINCT FROM other.classid
-                                               AND this.objid IS NOT DISTINCT FROM other.objid
-                                               AND this.objsubid IS NOT DISTINCT FROM other.objsubid
-                                               AND this.pid != other.pid
-                                               AND other.granted = 't'
+                      LEFT JOIN blockers b ON b.pid = a.pid
                       WHERE a.pid != pg_backend_pid()
-                      GROUP BY 1,2,3,4,5,6,7,9
-                      """)
+                      """
         else:
-            cur.execute("""
+            return """
                     SELECT datname,
                            a.pid as pid,
                            usename,
@@ -534,23 +617,39 @@ class PgstatCollector(StatCollector):
                            END AS query
                       FROM pg_stat_activity a
                       WHERE a.pid != pg_backend_pid() AND a.datname IS NOT NULL
-                      GROUP BY 1,2,3,4,5,6,7,9
-                      """)
-        results = cur.fetchall()
+                      """
+
+    def _read_pg_stat_activity(self):
+        """ Read data from pg_stat_activity """
+
+        self._refresh_recovery_status()
+        cur = self.pgcon.cursor()
+
+        # prepare the statement once per connection, so that the server does not need to parse
+        # and plan the query on every refresh. Prepared statements outlive the transaction.
+        if not self.activity_statement_prepared:
+            cur.execute('PREPARE {0} AS {1}'.format(self.ACTIVITY_STATEMENT, self._get_activity_query()))
+            self.activity_statement_prepared = True
+        cur.execute('EXECUTE {0}'.format(self.ACTIVITY_STATEMENT))
+        # rows are plain tuples, remember the column names to merge them into the process rows later
+        self.activity_columns = [d[0] for d in cur.description]
+        pid_idx = self.activity_columns.index('pid')
+        query_idx = self.activity_columns.index('query')
         # fill in the number of total connections, including ourselves
-        self.total_connections = len(results) + 1
-        self.active_connections = 0
+        self.total_connections = cur.rowcount + 1
         ret = {}
-        for r in results:
-            # stick multiline queries together
-            if r.get('query', None):
-                if r['query'] != 'idle':
-                    if r['pid'] != self.connection_pid:
-                        self.active_connections += 1
-                lines = r['query'].splitlines()
-                newlines = [re.sub(r'\s+', ' ', line.strip()) for line in lines]
-                r['query'] = ' '.join(newlines)
-            ret[r['pid']] = r
+        active_connections = 0
+        connection_pid = self.connection_pid
+        # iterate the cursor instead of fetchall(), so that the rows are converted one at a time
+        # rather than all materialized in an intermediate list first
+        for r in cur:
+            pid = r[pid_idx]
+            query = r[query_idx]
+            if query and query != 'idle' and pid != connection_pid:
+                active_connections += 1
+            # multiline queries are stuck together later in diff, only for the rows that get displayed
+            ret[pid] = r
+        self.active_connections = active_connections
         self.pgcon.commit()
         cur.close()
         return ret
@@ -577,32 +676,40 @@ class PgstatCollector(StatCollector):
         """ we only diff backend processes if new one is not idle and use pid to identify processes """
 
         self.rows_diff = []
-        self.running_diffs = []
-        self.blocked_diffs = {}
+        self.running_diffs = running_diffs = []
+        self.blocked_diffs = blocked_diffs = {}
+        # the loop runs for every process on every refresh, keep what it needs in local names
+        always_track_pids = self.always_track_pids
+        produce_diff_row = self._produce_diff_row
+        collapse_whitespace = self.QUERY_WHITESPACE_RE.sub
+        # index the previous rows by pid once, instead of scanning them for every current row
+        prev_rows = dict((x['pid'], x) for x in self.rows_prev)
         for cur in self.rows_cur:
-            if 'query' not in cur or cur['query'] != 'idle' or cur['pid'] in self.always_track_pids:
-                # look for the previous row corresponding to the current one
-                for x in self.rows_prev:
-                    if x['pid'] == cur['pid']:
-                        prev = x
-                        break
+            # idle backends are only diffed when they are tracked explicitly
+            if cur.get('query') == 'idle' and cur['pid'] not in always_track_pids:
+                continue
+            # look for the previous row corresponding to the current one
+            prev = prev_rows.get(cur['pid'])
+            if prev is None:
+                continue
+            # now we have a previous and a current row - do the diff
+            candidate = produce_diff_row(prev, cur)
+            if candidate is not None and len(candidate) > 0:
+                # stick multiline queries together
+                if candidate['query']:
+                    candidate['query'] = collapse_whitespace(' ', candidate['query']).strip()
+                if candidate['locked_by'] is None:
+                    running_diffs.append(candidate)
                 else:
-                    continue
-                # now we have a previous and a current row - do the diff
-                candidate = self._produce_diff_row(prev, cur)
-                if candidate is not None and len(candidate) > 0:
-                    if candidate['locked_by'] is None:
-                        self.running_diffs.append(candidate)
+                    # when determining the position where to put the blocked process,
+                    # only consider the first blocker. This will provide consustent
+                    # results for multiple processes blocked by the same set of blockers,
+                    # since the list is sorted by pid.
+                    block_pid = int(candidate['locked_by'].partition(',')[0])
+                    if block_pid not in blocked_diffs:
+                        blocked_diffs[block_pid] = [candidate]
                     else:
-                        # when determining the position where to put the blocked process,
-                        # only consider the first blocker. This will provide consustent
-                        # results for multiple processes blocked by the same set of blockers,
-                        # since the list is sorted by pid.
-                        block_pid = int(candidate['locked_by'].split(',')[0])
-                        if block_pid not in self.blocked_diffs:
-                            self.blocked_diffs[block_pid] = [candidate]
-                        else:
-                            self.blocked_diffs[block_pid].append(candidate)
+                        blocked_diffs[block_pid].append(candidate)
         # order the result rows by the start time value
         if len(self.blocked_diffs) == 0:
             self.rows_diff = self.running_diffs
@@ -617,21 +724,21 @@ class PgstatCollector(StatCollector):
             # and effectively build a separate tree for each blocker.
             self.running_diffs.sort(key=self.process_sort_key, reverse=True)
             # sort elements in the blocked lists, so that they still appear in the latest to earliest order
-            for key in self.blocked_diffs:
-                self.blocked_diffs[key].sort(key=self.process_sort_key)
+            for blocked in self.blocked_diffs.values():
+                blocked.sort(key=self.process_sort_key)
             for parent_row in self.running_diffs:
                 self.rows_diff.append(parent_row)
                 # if no processes blocked by this one - just skip to the next row
-                if parent_row['pid'] in self.blocked_diffs:
-                    blocked_temp.extend(self.blocked_diffs[parent_row['pid']])
-                    del self.blocked_diffs[parent_row['pid']]
-                    while len(blocked_temp) > 0:
+                children = self.blocked_diffs.pop(parent_row['pid'], None)
+                if children:
+                    blocked_temp.extend(children)
+                    while blocked_temp:
                         # traverse a tree (in DFS order) of all processes blocked by the current one
                         child_row = blocked_temp.pop()
                         self.rows_diff.append(child_row)
-                        if child_row['pid'] in self.blocked_diffs:
-                            blocked_temp.extend(self.blocked_diffs[child_row['pid']])
-                            del self.blocked_diffs[child_row['pid']]
+                        children = self.blocked_diffs.pop(child_row['pid'], None)
+                        if children:
+                            blocked_temp.extend(children)
 
     def output(self, method):
         return super(self.__class__, self).output(method, before_string='PostgreSQL processes:', after_string='\n')
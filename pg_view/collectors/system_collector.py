@@ -1,5 +1,6 @@
 from pg_view.collectors.base_collector import StatCollector
 from pg_view.loggers import logger
+from pg_view.utils import ProcFile
 
 
 class SystemStatCollector(StatCollector):
@@ -10,6 +11,7 @@ class SystemStatCollector(StatCollector):
 
     def __init__(self):
         super(SystemStatCollector, self).__init__()
+        self.proc_stat_file = ProcFile(SystemStatCollector.PROC_STAT_FILENAME)
 
         self.transform_list_data = [
             {'out': 'utime', 'in': 0, 'fn': float},
@@ -144,6 +146,7 @@ class SystemStatCollector(StatCollector):
         self.previos_total_cpu_time = 0
         self.current_total_cpu_time = 0
         self.cpu_time_diff = 0
+        self.cpu_time_diff_inverse = 0.0
         self.ncurses_custom_fields = {'header': False, 'prefix': 'sys: ', 'prepend_column_headers': True}
 
         self.postinit()
@@ -166,6 +169,8 @@ class SystemStatCollector(StatCollector):
         self.previos_total_cpu_time = self.current_total_cpu_time
         self.current_total_cpu_time = total_cpu_time
         self.cpu_time_diff = self.current_total_cpu_time - self.previos_total_cpu_time
+        # all cpu fields are divided by the same difference, multiply them by its inverse instead
+        self.cpu_time_diff_inverse = 1.0 / self.cpu_time_diff if self.cpu_time_diff > 0 else 0.0
 
     def _read_proc_stat(self):
         """ see man 5 proc for details (/proc/stat). We don't parse cpu info here """
@@ -173,30 +178,32 @@ class SystemStatCollector(StatCollector):
         raw_result = {}
         result = {}
         try:
-            fp = open(SystemStatCollector.PROC_STAT_FILENAME, 'rU')
+            data = self.proc_stat_file.read().decode('utf-8', 'replace')
             # split /proc/stat into the name - value pairs
-            for line in fp:
-                elements = line.strip().split()
+            for line in data.splitlines():
+                elements = line.split()
                 if len(elements) > 2:
                     raw_result[elements[0]] = elements[1:]
                 elif len(elements) > 1:
                     raw_result[elements[0]] = elements[1]
                 # otherwise, the line is probably empty or bogus and should be skipped
-            result = self._transform_input(raw_result)
-        except IOError:
+            result = self._transform_dict(raw_result)
+        except OSError:
             logger.error('Unable to read {0}, global data will be unavailable'.format(self.PROC_STAT_FILENAME))
         return result
 
     def _cpu_time_diff(self, colname, cur, prev):
-        if cur.get(colname, None) and prev.get(colname, None) and self.cpu_time_diff > 0:
-            return (cur[colname] - prev[colname]) / self.cpu_time_diff
+        cur_val = cur.get(colname)
+        prev_val = prev.get(colname)
+        if cur_val and prev_val and self.cpu_time_diff_inverse:
+            return (cur_val - prev_val) * self.cpu_time_diff_inverse
         else:
             return None
 
     def _read_cpu_data(self, cpu_row):
         """ Parse the cpu row from /proc/stat """
 
-        return self._transform_input(cpu_row)
+        return self._transform_list(cpu_row)
 
     def output(self, method):
         return super(SystemStatCollector, self).output(method, before_string='System statistics:', after_string='\n')
@@ -8,31 +8,27 @@ else:
 
 class DiskCollectorConsumer(object):
     """ consumes information from the disk collector and provides it for the local
-        collector classes running in the same subprocess.
+        collector classes running in the main thread.
     """
     def __init__(self, q):
-        self.result = {}
         self.cached_result = {}
+        # work directories of the last result that haven't been fetched yet
+        self.unfetched = set()
         self.q = q
 
     def consume(self):
         # if we haven't consumed the previous value
-        if len(self.result) != 0:
+        if self.unfetched:
             return
         try:
-            self.result = self.q.get_nowait()
-            self.cached_result = self.result.copy()
+            self.cached_result = self.q.get_nowait()
         except Empty:
             # we are too fast, just do nothing.
             pass
         else:
+            self.unfetched = set(self.cached_result)
             self.q.task_done()
 
     def fetch(self, wd):
-        data = None
-        if wd in self.result:
-            data = self.result[wd]
-            del self.result[wd]
-        elif wd in self.cached_result:
-            data = self.cached_result[wd]
-        return data
+        self.unfetched.discard(wd)
+        return self.cached_result.get(wd)
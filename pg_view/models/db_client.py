@@ -1,29 +1,33 @@
-import glob
+import errno
 import os
 import re
+import socket
 
 import psycopg2
 
 from pg_view.loggers import logger
 from pg_view.models.parsers import ProcNetParser
-from pg_view.utils import STAT_FIELD, dbversion_as_float
+from pg_view.utils import STAT_FIELD, dbversion_as_float, read_small_file, split_proc_stat
+
+# target of a /proc/[pid]/fd link of a socket is socket:[<inode>], i.e. socket:[8430]
+_SOCKET_LINK_PREFIX = 'socket:['
+# data directory layout with the cluster name and an optional major version, i.e. /pgsql_bar/9.4/data
+_DBNAME_RE = re.compile(r'/pgsql_(.*?)(?:/\d+(?:\.\d+)?)?/data/?')
+# seconds to wait for a TCP connection before trying a candidate address with psycopg2
+TCP_PROBE_TIMEOUT = 0.25
 
 
 def read_postmaster_pid(work_directory, dbname):
     """ Parses the postgres directory tree and extracts the pid of the postmaster process """
 
-    fp = None
     try:
-        fp = open('{0}/postmaster.pid'.format(work_directory))
-        pid = fp.readline().strip()
+        # the pid is on the first line. Do not cache it, reconnect() calls us to find the new postmaster
+        pid = read_small_file(work_directory + '/postmaster.pid').split(b'\n', 1)[0].strip().decode('ascii')
     except Exception:
         # XXX: do not bail out in case we are collecting data for multiple PostgreSQL clusters
         logger.error('Unable to read postmaster.pid for {name} at {wd}\n HINT: \
             make sure Postgres is running'.format(name=dbname, wd=work_directory))
         return None
-    finally:
-        if fp is not None:
-            fp.close()
     return pid
 
 
@@ -42,19 +46,19 @@ def build_connection(host, port, user, database):
 
 def pick_connection_arguments(conn_args, username, dbname):
     """ go through all decected connections, picking the first one that actually works """
-    result = {}
     for conn_type in 'unix', 'tcp', 'tcp6':
-        if len(result) > 0:
-            break
         for arg in conn_args.get(conn_type, []):
             if can_connect_with_connection_arguments(*arg, username=username, dbname=dbname):
-                (result['host'], result['port']) = arg
-                break
-    return result
+                return {'host': arg[0], 'port': arg[1]}
+    return {}
 
 
 def can_connect_with_connection_arguments(host, port, username, dbname):
     """ check that we can connect given the specified arguments """
+    # unix socket directories are absolute paths, for TCP addresses check that something listens there
+    # before going through the connection and authentication with psycopg2.
+    if host and not host.startswith('/') and not is_tcp_port_open(host, port):
+        return False
     conn = build_connection(host, port, username, dbname)
     try:
         test_conn = psycopg2.connect(**conn)
@@ -64,6 +68,16 @@ def can_connect_with_connection_arguments(host, port, username, dbname):
     return True
 
 
+def is_tcp_port_open(host, port, timeout=TCP_PROBE_TIMEOUT):
+    """ check whether a TCP connection to host:port can be established """
+    try:
+        s = socket.create_connection((host, int(port)), timeout)
+    except (socket.error, ValueError):
+        return False
+    s.close()
+    return True
+
+
 def detect_with_proc_net(pid):
     inodes = fetch_socket_inodes_for_process(pid)
     parser = ProcNetParser()
@@ -162,44 +176,47 @@ def get_postmasters_directories():
     pg_pids = []
     postmasters = {}
     pg_proc_stat = {}
-    # get all 'number' directories from /proc/ and sort them
-    for f in glob.glob('/proc/[0-9]*/stat'):
-        # make sure the particular pid is accessible to us
-        if not os.access(f, os.R_OK):
+    # the field positions are looked up for every process, keep them in locals
+    st_pid, st_process_name, st_state = STAT_FIELD.st_pid, STAT_FIELD.st_process_name, STAT_FIELD.st_state
+    st_ppid, st_start_time = STAT_FIELD.st_ppid, STAT_FIELD.st_start_time
+    # get all 'number' directories from /proc/
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
             continue
+        f = '/proc/{0}/stat'.format(name)
         try:
-            with open(f, 'rU') as fp:
-                stat_fields = fp.read().strip().split()
-        except Exception:
-            logger.error('failed to read {0}'.format(f))
+            # stat is plain ASCII, keep it as bytes and only convert the fields we need
+            stat_fields = split_proc_stat(read_small_file(f))
+        except OSError as e:
+            # the process might have exited or be inaccessible to us
+            if e.errno not in (errno.ENOENT, errno.ESRCH, errno.EACCES):
+                logger.error('failed to read {0}'.format(f))
             continue
         # read PostgreSQL processes. Avoid zombies
-        if len(stat_fields) < STAT_FIELD.st_start_time + 1 or stat_fields[STAT_FIELD.st_process_name] not in \
-                ('(postgres)', '(postmaster)') or stat_fields[STAT_FIELD.st_state] == 'Z':
-            if stat_fields[STAT_FIELD.st_state] == 'Z':
+        if len(stat_fields) < st_start_time + 1 or stat_fields[st_process_name] not in \
+                (b'(postgres)', b'(postmaster)') or stat_fields[st_state] == b'Z':
+            if stat_fields[st_state] == b'Z':
                 logger.warning('zombie process {0}'.format(f))
-            if len(stat_fields) < STAT_FIELD.st_start_time + 1:
+            if len(stat_fields) < st_start_time + 1:
                 logger.error('{0} output is too short'.format(f))
             continue
         # convert interesting fields to int
-        for no in STAT_FIELD.st_pid, STAT_FIELD.st_ppid, STAT_FIELD.st_start_time:
+        for no in st_pid, st_ppid, st_start_time:
             stat_fields[no] = int(stat_fields[no])
-        pid = stat_fields[STAT_FIELD.st_pid]
+        pid = stat_fields[st_pid]
         pg_proc_stat[pid] = stat_fields
         pg_pids.append(pid)
 
     # we have a pid -> stat fields map, and an array of all pids.
-    # sort pids array by the start time of the process, so that we
+    # if parent is also a postgres process - no way this is a postmaster.
+    # Filter those out first, there are usually just a few candidates left out of all backends.
+    candidates = [pid for pid in pg_pids if pg_proc_stat[pid][st_ppid] not in pg_proc_stat]
+    # sort the candidates by the start time of the process, so that we
     # minimize the number of looks into /proc/../cmdline latter
     # the idea is that processes starting earlier are likely to be
     # parent ones.
-    pg_pids.sort(key=lambda pid: pg_proc_stat[pid][STAT_FIELD.st_start_time])
-    for pid in pg_pids:
-        st = pg_proc_stat[pid]
-        ppid = st[STAT_FIELD.st_ppid]
-        # if parent is also a postgres process - no way this is a postmaster
-        if ppid in pg_pids:
-            continue
+    candidates.sort(key=lambda pid: pg_proc_stat[pid][st_start_time])
+    for pid in candidates:
         link_filename = '/proc/{0}/cwd'.format(pid)
         # now get its data directory in the /proc/[pid]/cmdline
         if not os.access(link_filename, os.R_OK):
@@ -229,10 +246,9 @@ def get_postmasters_directories():
                 'PostgreSQL candidate directory {0} is missing PG_VERSION file, have to skip it'.format(pg_dir))
             continue
         try:
-            fp = open(PG_VERSION_FILENAME, 'rU')
-            val = fp.read().strip()
-            if val is not None and len(val) >= 2:
-                version = float(val)
+            # the file holds just the major version, i.e. 9.6 or 11, a single unbuffered read is enough
+            val = read_small_file(PG_VERSION_FILENAME, 16).strip().decode('ascii', 'replace')
+            version = float(val)
         except os.error:
             logger.error(
                 'unable to read version number from PG_VERSION directory {0}, have to skip it'.format(pg_dir))
@@ -250,22 +266,24 @@ def fetch_socket_inodes_for_process(pid):
     """ read /proc/[pid]/fd and get those that correspond to sockets """
     inodes = []
     fd_dir = '/proc/{0}/fd'.format(pid)
-    if not os.access(fd_dir, os.R_OK):
+    try:
+        fds = os.listdir(fd_dir)
+    except os.error:
         logger.warning("unable to read {0}".format(fd_dir))
-    else:
-        for link in glob.glob('{0}/*'.format(fd_dir)):
-            if not os.access(link, os.F_OK):
-                logger.warning("unable to access link {0}".format(link))
-                continue
-            try:
-                target = os.readlink(link)
-            except Exception:
+        return inodes
+    for fd in fds:
+        link = '{0}/{1}'.format(fd_dir, fd)
+        try:
+            target = os.readlink(link)
+        except os.error as e:
+            # the descriptor might have been closed after we have listed the directory
+            if e.errno != errno.ENOENT:
                 logger.error('coulnd\'t read link {0}'.format(link))
-            else:
-                # socket:[8430]
-                match = re.search(r'socket:\[(\d+)\]', target)
-                if match:
-                    inodes.append(int(match.group(1)))
+            continue
+        if target.startswith(_SOCKET_LINK_PREFIX) and target.endswith(']'):
+            inode = target[len(_SOCKET_LINK_PREFIX):-1]
+            if inode.isdigit():
+                inodes.append(int(inode))
     return inodes
 
 
@@ -283,8 +301,8 @@ def detect_with_postmaster_pid(work_directory, version):
             'cannot access PostgreSQL cluster directory {0}: permission denied'.format(work_directory))
         return None
     try:
-        with open(PID_FILE, 'rU') as fp:
-            lines = fp.readlines()
+        # only the first 6 lines are needed, they fit in a single read
+        lines = read_small_file(PID_FILE).decode('utf-8', 'replace').splitlines()
     except os.error as e:
         logger.error('could not read {0}: {1}'.format(PID_FILE, e))
         return None
@@ -312,8 +330,12 @@ def get_dbname_from_path(db_path):
     'foo'
     >>> get_dbname_from_path('/pgsql_bar/9.4/data')
     'bar'
+    >>> get_dbname_from_path('/pgsql_bar/10/data')
+    'bar'
+    >>> get_dbname_from_path('/home/postgres/pgsql_bar/11/data/')
+    'bar'
     """
-    m = re.search(r'/pgsql_(.*?)(/\d+.\d+)?/data/?', db_path)
+    m = _DBNAME_RE.search(db_path)
     if m:
         dbname = m.group(1)
     else:
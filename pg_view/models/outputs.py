@@ -1,9 +1,8 @@
 import curses
-import os
 import re
+import sys
 import time
 from collections import namedtuple
-from operator import itemgetter
 
 from pg_view import flags
 from pg_view.meta import __appname__, __version__, __license__
@@ -37,7 +36,9 @@ class CommonOutput(object):
 
     @staticmethod
     def refresh():
-        os.system('clear')
+        # move the cursor home and clear the screen, what clear(1) does, without spawning it on every refresh
+        sys.stdout.write('\x1b[H\x1b[2J')
+        sys.stdout.flush()
 
 
 class CursesOutput(object):
@@ -49,6 +50,8 @@ class CursesOutput(object):
     MIN_TRUNCATE_FIELD_LENGTH = 50  # do not try to truncate fields lower than this size
     MIN_TRUNCATED_LEAVE = 10  # do not leave the truncated field if it's less than this size
 
+    WORD_RE = re.compile(r'\S+')
+
     def __init__(self, screen):
         super(CursesOutput, self)
         self.screen = screen
@@ -56,6 +59,13 @@ class CursesOutput(object):
         self.output_order = []
         self.show_help = False
         self.is_color_supported = True
+        self.screen_y = self.screen_x = None
+        # (collector, row number, field) -> (cell input, colored words), see show_collector_data
+        self.cell_cache = {}
+        # (help bar state, addnstr arguments), see show_help_bar
+        self.help_bar_cache = (None, [])
+        # (second, formatted clock), see show_clock
+        self.clock = (None, '')
 
         self._init_display()
 
@@ -98,6 +108,7 @@ class CursesOutput(object):
 
     def toggle_help(self):
         self.show_help = self.show_help is False
+        self.cell_cache.clear()
 
     def refresh(self):
         """ actual data output goes here """
@@ -105,10 +116,15 @@ class CursesOutput(object):
         self.next_y = 0
 
         # ncurses doesn't erase the old contents when the screen is refreshed,
-        # hence, we need to do it manually here.
+        # hence, we need to do it manually here. erase() only blanks the virtual
+        # screen, so doupdate() below sends the changed cells to the terminal.
         # update screen coordinates
-        self.screen.erase()
-        self.update_screen_metrics()
+        if self.update_screen_metrics():
+            # the terminal has been resized, repaint it from scratch
+            self.screen.clear()
+            self.cell_cache.clear()
+        else:
+            self.screen.erase()
         if not self.show_help:
             for collector in self.output_order:
                 if self.next_y < self.screen_y - 2:
@@ -120,7 +136,8 @@ class CursesOutput(object):
         # show clock if possible
         self.show_clock()
         self.show_help_bar()
-        self.screen.refresh()
+        self.screen.noutrefresh()
+        curses.doupdate()
         self.output_order = []
 
     def screen_erase(self):
@@ -128,7 +145,11 @@ class CursesOutput(object):
         self.screen.refresh()
 
     def update_screen_metrics(self):
-        self.screen_y, self.screen_x = self.screen.getmaxyx()
+        """ update screen coordinates, return True if they have changed since the last call """
+        screen_y, screen_x = self.screen.getmaxyx()
+        changed = (screen_y, screen_x) != (self.screen_y, self.screen_x)
+        self.screen_y, self.screen_x = screen_y, screen_x
+        return changed
 
     def print_text(self, starty, startx, text, attr=None, trim_middle=False):
         """ output string, truncate it if it doesn't fit, return the new X position"""
@@ -145,13 +166,21 @@ class CursesOutput(object):
         else:
             return startx
 
-    def show_help_bar_item(self, key, description, selected, x):
-        x = self.print_text(self.screen_y - 1, x, '{0}:'.format(key),
-                            (self.COLOR_MENU_SELECTED if selected else self.COLOR_MENU) | curses.A_BOLD)
-        x = self.print_text(self.screen_y - 1, x, '{0} '.format(description),
-                            self.COLOR_MENU_SELECTED if selected else self.COLOR_MENU)
+    def show_help_bar_item(self, key, description, selected, x, segments):
+        x = self._add_help_bar_text(segments, x, '{0}:'.format(key),
+                                    (self.COLOR_MENU_SELECTED if selected else self.COLOR_MENU) | curses.A_BOLD)
+        x = self._add_help_bar_text(segments, x, '{0} '.format(description),
+                                    self.COLOR_MENU_SELECTED if selected else self.COLOR_MENU)
         return x
 
+    def _add_help_bar_text(self, segments, startx, text, attr):
+        """ queue the text for the bottom line, truncated the same way as print_text does it """
+        remaining_len = min(self.screen_x - (startx + 1), len(text))
+        if remaining_len > 0:
+            segments.append((self.screen_y - 1, startx, text, remaining_len, attr))
+            return startx + remaining_len
+        return startx
+
     def show_help_bar(self):
         # only show help if we have enough screen real estate
         if self.next_y > self.screen_y - 1:
@@ -167,24 +196,29 @@ class CursesOutput(object):
             ('h', 'help', self.show_help),
         )
 
-        next_x = 0
-        for item in menu_items:
-            next_x = self.show_help_bar_item(x=next_x, *item)
+        # the bar only changes when one of the toggles or the screen size does
+        key = (menu_items, self.screen_y, self.screen_x)
+        if self.help_bar_cache[0] != key:
+            segments = []
+            next_x = 0
+            for item in menu_items:
+                next_x = self.show_help_bar_item(x=next_x, segments=segments, *item)
+            self._add_help_bar_text(segments, next_x, 'v{0}'.format(__version__).rjust(self.screen_x - next_x - 1),
+                                    self.COLOR_MENU | curses.A_BOLD)
+            self.help_bar_cache = (key, segments)
 
-        self.print_text(self.screen_y - 1, next_x, 'v{0}'.format(__version__).rjust(self.screen_x - next_x - 1),
-                        self.COLOR_MENU | curses.A_BOLD)
+        for y, x, text, n, attr in self.help_bar_cache[1]:
+            self.screen.addnstr(y, x, text, n, attr)
 
     def show_clock(self):
         clock_str_len = len(self.CLOCK_FORMAT)
-        clean = True
-        for pos in range(0, clock_str_len):
-            x = self.screen.inch(0, self.screen_x - clock_str_len - 1 + pos) & 255
-            if x != ord(' '):
-                clean = False
-                break
-        if clean:
-            clock_str = time.strftime(self.CLOCK_FORMAT, time.localtime())
-            self.screen.addnstr(0, self.screen_x - clock_str_len, clock_str, clock_str_len)
+        # only draw the clock if nothing has been written to that place yet
+        if not self.screen.instr(0, self.screen_x - clock_str_len - 1, clock_str_len).strip(b' '):
+            # the clock has a one second resolution, while refreshes may be more frequent
+            now = int(time.time())
+            if now != self.clock[0]:
+                self.clock = (now, time.strftime(self.CLOCK_FORMAT, time.localtime(now)))
+            self.screen.addnstr(0, self.screen_x - clock_str_len, self.clock[1], clock_str_len)
 
     def _status_to_color(self, status, highlight):
         if status == COLSTATUS.cs_critical:
@@ -196,7 +230,10 @@ class CursesOutput(object):
         return self.COLOR_NORMAL
 
     def color_text(self, status_map, highlight, text, header, header_position):
-        """ for a given header and text - decide on the position and output color """
+        """ for a given header and text - decide on the position and output color.
+
+            Returns a list of (start, word, width, color) tuples, the start is relative to the field.
+        """
         result = []
         xcol = 0
         # header_position is either put the header before the value, or after
@@ -217,12 +254,7 @@ class CursesOutput(object):
 
     def color_header(self, header, xcol, result):
         """ add a header outout information"""
-        result.append({
-            'start': xcol,
-            'width': len(header),
-            'word': header,
-            'color': self.COLOR_NORMAL,
-        })
+        result.append((xcol, header, len(header), self.COLOR_NORMAL))
         return xcol + len(header) + 1
 
     def color_value(self, val, xcol, status_map, highlight, result):
@@ -233,19 +265,19 @@ class CursesOutput(object):
         # get all words from the text and their relative positions
         if len(status_map) == 1 and -1 in status_map:
             color = self._status_to_color(status_map[-1], highlight)
-            result.append({
-                'start': xcol,
-                'word': val,
-                'width': len(val),
-                'color': color,
-            })
+            result.append((xcol, val, len(val), color))
             xcol += len(val) + 1
+        elif not any(status_map.values()) and not (highlight and status_map):
+            # every word would get the normal color, output the text in one piece,
+            # placing the next column as if it had been split into words.
+            result.append((xcol, val, len(val), self.COLOR_NORMAL))
+            last_position = xcol + len(val.rstrip())
+            xcol += last_position + 1
         else:
             # XXX: we are calculating the world boundaries again here
             # (first one in calculate_output_status) and using a different method to do so.
-            words = list(re.finditer(r'(\S+)', val))
             last_position = xcol
-            for no, word in enumerate(words):
+            for no, word in enumerate(self.WORD_RE.finditer(val)):
                 if no in status_map:
                     status = status_map[no]
                     color = self._status_to_color(status, highlight)
@@ -257,12 +289,7 @@ class CursesOutput(object):
                     color = self.COLOR_NORMAL
                 word_len = word.end(0) - word.start(0)
                 # convert the relative start to the absolute one
-                result.append({
-                    'start': xcol + word.start(0),
-                    'word': word.group(0),
-                    'width': word_len,
-                    'color': color,
-                })
+                result.append((xcol + word.start(0), word.group(0), word_len, color))
                 last_position = xcol + word.end(0)
             xcol += last_position + 1
         return xcol
@@ -307,6 +334,7 @@ class CursesOutput(object):
 
         rows = self.data[collector]['rows']
         statuses = self.data[collector]['statuses']
+        columns = self.data[collector]['columns']
         align = self.data[collector]['align']
         header = self.data[collector].get('header', False) or False
         prepend_column_headers = self.data[collector].get('prepend_column_headers', False)
@@ -339,27 +367,38 @@ class CursesOutput(object):
                     self.print_text(self.screen_y - 2, layout[field]['start'], '.' * layout[field]['width'])
                     self.next_y += 1
                 break
-            self.show_status_of_invisible_fields(layout, status, 0)
+            self.show_status_of_invisible_fields(layout, columns, status, 0)
             for field in layout:
+                idx = columns[field]
                 # calculate colors and alignment for the data value
                 column_alignment = (align.get(field,
                                               COLALIGN.ca_none) if not prepend_column_headers else COLALIGN.ca_left)
                 w = layout[field]['width']
-                # now check if we need to add ellipsis to indicate that the value has been truncated.
-                # we don't do this if the value is less than a certain length or when the column is marked as
-                # containing truncated values, but the actual value is not truncated.
-
-                if layout[field].get('truncate', False):
-                    # XXX: why do we truncate even when truncate for the column is set to False?
-                    header, text = self.truncate_column_value(row[field], w, w > self.MIN_ELLIPSIS_FIELD_LENGTH)
+                truncate = layout[field].get('truncate', False)
+                # the type decides the alignment of the columns without the explicit one
+                column_type = types.get(field, COLTYPES.ct_string)
+                # most of the cells don't change between refreshes, reuse their colored words in that case.
+                cell = (row[idx], status[idx], w, truncate, column_alignment, column_type, highlights[field])
+                cell_key = (collector, i, field)
+                cached = self.cell_cache.get(cell_key)
+                if cached is not None and cached[0] == cell:
+                    color_fields = cached[1]
                 else:
-                    header, text = row[field].header, row[field].value
-                text = self._align_field(text, header, w, column_alignment, types.get(field, COLTYPES.ct_string))
-                color_fields = self.color_text(status[field], highlights[field],
-                                               text, header, row[field].header_position)
-                for f in color_fields:
-                    self.screen.addnstr(self.next_y, layout[field]['start'] + f['start'], f['word'], f['width'],
-                                        f['color'])
+                    # now check if we need to add ellipsis to indicate that the value has been truncated.
+                    # we don't do this if the value is less than a certain length or when the column is marked as
+                    # containing truncated values, but the actual value is not truncated.
+                    if truncate:
+                        # XXX: why do we truncate even when truncate for the column is set to False?
+                        header, text = self.truncate_column_value(row[idx], w, w > self.MIN_ELLIPSIS_FIELD_LENGTH)
+                    else:
+                        header, text = row[idx].header, row[idx].value
+                    text = self._align_field(text, header, w, column_alignment, column_type)
+                    color_fields = self.color_text(status[idx], highlights[field],
+                                                   text, header, row[idx].header_position)
+                    self.cell_cache[cell_key] = (cell, color_fields)
+                field_start = layout[field]['start']
+                for start, word, width, color in color_fields:
+                    self.screen.addnstr(self.next_y, field_start + start, word, width, color)
             self.next_y += 1
 
     @staticmethod
@@ -427,48 +466,53 @@ class CursesOutput(object):
         candrop = [name for name in fields if name not in to_hide and not noautohide.get(name, False)]
         return self.layout_x(xstart, width, fields, to_hide, candrop)
 
-    def show_status_of_invisible_fields(self, layout, status, xstart):
+    def show_status_of_invisible_fields(self, layout, columns, status, xstart):
         """
             Show red/blue bar to the left of the screen representing the most critical
             status of the fields that are now shown.
         """
 
-        status_rest = self._invisible_fields_status(layout, status)
+        status_rest = self._invisible_fields_status(layout, columns, status)
         if status_rest != COLSTATUS.cs_ok:
             color_rest = self._status_to_color(status_rest, False)
             self.screen.addch(self.next_y, 0, ' ', color_rest)
 
     @staticmethod
     def _align_field(text, header, width, align, typ):
+        """ pad the text, the header (if any) is not included in the result but takes its space in the field
+
+        >>> CursesOutput._align_field('42', 'MB', 8, COLALIGN.ca_none, COLTYPES.ct_number)
+        '   42'
+        >>> CursesOutput._align_field('abc', '', 8, COLALIGN.ca_center, COLTYPES.ct_string)
+        '  abc   '
+        """
         if align == COLALIGN.ca_none:
             if typ == COLTYPES.ct_number:
                 align = COLALIGN.ca_right
             else:
                 align = COLALIGN.ca_left
-        textlen = len(text) + len(header) + (1 if header and text else 0)
-        width_left = width - textlen
+        text = str(text)
+        width -= len(header) + (1 if header and text else 0)
         if align == COLALIGN.ca_right:
-            return '{0}{1}'.format(' ' * width_left, text)
+            return text.rjust(width)
         if align == COLALIGN.ca_center:
-            left_space = width_left / 2
-            right_space = width_left - left_space
-            return '{0}{1}{2}'.format(' ' * left_space, text, ' ' * right_space)
-        return str(text)
+            # the odd space goes to the right
+            return text.rjust((width + len(text)) // 2).ljust(width)
+        return text
 
     def _get_fields_sorted_by_position(self, collector):
-        pos = self.data[collector]['pos']
-        sorted_by_pos = sorted(((x, pos[x]) for x in pos if pos[x] != -1), key=itemgetter(1))
-        return [f[0] for f in sorted_by_pos]
+        # positions are static, the collector sorts the fields once for every output header
+        return self.data[collector]['sorted_fields']
 
     @staticmethod
-    def _invisible_fields_status(layout, statuses):
+    def _invisible_fields_status(layout, columns, statuses):
         highest_status = COLSTATUS.cs_ok
-        invisible = [col for col in statuses if col not in layout]
-        for col in invisible:
-            for no in statuses[col]:
-                if statuses[col][no] > highest_status:
-                    highest_status = statuses[col][no]
-                    if highest_status == COLSTATUS.cs_critical:
+        for col, idx in columns.items():
+            if col not in layout and statuses[idx]:
+                status = max(statuses[idx].values())
+                if status > highest_status:
+                    highest_status = status
+                    if highest_status >= COLSTATUS.cs_critical:
                         return COLSTATUS.cs_critical
         return highest_status
 
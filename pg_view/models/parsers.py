@@ -1,6 +1,6 @@
 import os
-import re
 import socket
+import struct
 
 from pg_view.loggers import logger
 
@@ -13,19 +13,20 @@ class ProcNetParser:
     NET_UNIX_FILENAME = '/proc/net/unix'
     NET_TCP_FILENAME = '/proc/net/tcp'
     NET_TCP6_FILENAME = '/proc/net/tcp6'
+    # PostgreSQL unix sockets are named <directory>/.s.PGSQL.<port>
+    PG_UNIX_SOCKET_PREFIX = '/.s.PGSQL.'
 
     def __init__(self):
         self.reinit()
 
     def reinit(self):
+        # socket inode -> [socket type, line], filled only for the inodes we are asked about
         self.sockets = {}
         self.unix_socket_header_len = 0
-        # initialize the sockets hash with the contents of unix
-        # and tcp sockets. tcp IPv6 is also read if it's present
-        for fname in ProcNetParser.NET_UNIX_FILENAME, ProcNetParser.NET_TCP_FILENAME:
-            self.read_socket_file(fname)
+        # unix and tcp sockets are scanned when we are asked about the inodes. tcp IPv6 is also read if it's present
+        self.socket_files = [ProcNetParser.NET_UNIX_FILENAME, ProcNetParser.NET_TCP_FILENAME]
         if os.access(ProcNetParser.NET_TCP6_FILENAME, os.R_OK):
-            self.read_socket_file(ProcNetParser.NET_TCP6_FILENAME)
+            self.socket_files.append(ProcNetParser.NET_TCP6_FILENAME)
 
     @staticmethod
     def _hex_to_int_str(val):
@@ -33,18 +34,19 @@ class ProcNetParser:
 
     @staticmethod
     def _hex_to_ip(val):
-        newval = format(socket.ntohl(int(val, 16)), '08X')
-        return '.'.join([str(int(newval[i: i + 2], 16)) for i in range(0, 8, 2)])
+        """ the kernel prints the address as a 32-bit word in the host byte order """
+        return socket.inet_ntoa(struct.pack('=I', int(val, 16)))
 
     @staticmethod
     def _hex_to_ipv6(val):
-        newval_list = [format(socket.ntohl(int(val[x: x + 8], 16)), '08X') for x in range(0, 32, 8)]
-        return ':'.join([':'.join((x[:4], x[4:])) for x in newval_list])
+        """ same as above, for each of the four 32-bit words of the address """
+        return socket.inet_ntop(socket.AF_INET6, struct.pack('=4I', *[int(val[x: x + 8], 16) for x in range(0, 32, 8)]))
 
     def match_socket_inodes(self, inodes):
         """ return the dictionary with socket types as strings,
             containing addresses (or unix path names) and port
         """
+        self._find_socket_lines(inodes)
         result = {}
         for inode in inodes:
             if inode in self.sockets:
@@ -58,32 +60,40 @@ class ProcNetParser:
                     result[socket_type] = [addr_tuple[1:]]
         return result
 
-    def read_socket_file(self, filename):
-        """ read file content, produce a dict of socket inode -> line """
+    def _find_socket_lines(self, inodes):
+        """ look up the lines of the given inodes, scanning each file once and without parsing other lines """
+        wanted = dict((str(inode), inode) for inode in inodes if inode not in self.sockets)
+        for filename in self.socket_files:
+            if not wanted:
+                break
+            self.read_socket_file(filename, wanted)
+
+    def read_socket_file(self, filename, wanted):
+        """ stream the file content, remembering only the lines of the wanted inodes and removing them from wanted """
         socket_type = filename.split('/')[-1]
         try:
             with open(filename) as fp:
-                data = fp.readlines()
+                header = fp.readline().split()
+                if socket_type == 'unix':
+                    self.unix_socket_header_len = len(header)
+                indexes = [i for i, name in enumerate(header) if name.lower() == 'inode']
+                if len(indexes) != 1:
+                    logger.error('attribute \'inode\' in the header of {0} is not unique or missing: {1}'.format(
+                        filename, header))
+                    return
+                inode_idx = indexes[0]
+                if socket_type != 'unix':
+                    # for a tcp socket, 2 pairs of fields (tx_queue:rx_queue and tr:tm->when
+                    # are separated by colons and not spaces)
+                    inode_idx -= 2
+                for line in fp:
+                    fields = line.split(None, inode_idx + 1)
+                    if len(fields) > inode_idx and fields[inode_idx] in wanted:
+                        self.sockets[wanted.pop(fields[inode_idx])] = [socket_type, line]
+                        if not wanted:
+                            break
         except os.error as e:
             logger.error('unable to read from {0}: OS reported {1}'.format(filename, e))
-        # remove the header
-        header = (data.pop(0)).split()
-        if socket_type == 'unix':
-            self.unix_socket_header_len = len(header)
-        indexes = [i for i, name in enumerate(header) if name.lower() == 'inode']
-        if len(indexes) != 1:
-            logger.error('attribute \'inode\' in the header of {0} is not unique or missing: {1}'.format(
-                filename, header))
-        else:
-            inode_idx = indexes[0]
-            if socket_type != 'unix':
-                # for a tcp socket, 2 pairs of fields (tx_queue:rx_queue and tr:tm->when
-                # are separated by colons and not spaces)
-                inode_idx -= 2
-            for line in data:
-                fields = line.split()
-                inode = int(fields[inode_idx])
-                self.sockets[inode] = [socket_type, line]
 
     def parse_single_line(self, inode):
         """ apply socket-specific parsing rules """
@@ -93,12 +103,11 @@ class ProcNetParser:
             # we are interested in everything in the last field
             # note that it may contain spaces or other separator characters
             fields = line.split(None, self.unix_socket_header_len - 1)
-            socket_path = fields[-1]
+            socket_path = fields[-1].rstrip('\n')
             # check that it looks like a PostgreSQL socket
-            match = re.search(r'(.*?)/\.s\.PGSQL\.(\d+)$', socket_path)
-            if match:
-                # path - port
-                result = (socket_type,) + match.groups(1)
+            path, prefix, port = socket_path.rpartition(self.PG_UNIX_SOCKET_PREFIX)
+            if prefix and port.isdigit():
+                result = (socket_type, path, port)
             else:
                 logger.warning(
                     'unix socket name is not recognized as belonging to PostgreSQL: {0}'.format(socket_path))
@@ -1,4 +1,5 @@
-import re
+import errno
+import os
 import resource
 import sys
 
@@ -18,16 +19,16 @@ def enum(**enums):
 STAT_FIELD = enum(st_pid=0, st_process_name=1, st_state=2, st_ppid=3, st_start_time=21)
 BLOCK_SIZE = 1024
 MEM_PAGE_SIZE = resource.getpagesize()
+SMALL_FILE_READ_SIZE = 4096
+PROC_FILE_READ_SIZE = 16384
 OUTPUT_METHOD = enum(console='console', json='json', curses='curses')
+_CONFIGURATION_OPTIONS = frozenset(('port', 'host', 'user', 'dbname'))
+_VALID_OUTPUT_METHODS = frozenset(v for k, v in OUTPUT_METHOD.__dict__.items()
+                                  if not k.startswith('_') and isinstance(v, str))
 
 
 def get_valid_output_methods():
-    result = []
-    for key in OUTPUT_METHOD.__dict__.keys():
-        if re.match(r'^[a-z][a-z_]+$', key):
-            value = OUTPUT_METHOD.__dict__[key]
-            result.append(value)
-    return result
+    return sorted(_VALID_OUTPUT_METHODS)
 
 
 def output_method_is_valid(method):
@@ -37,7 +38,89 @@ def output_method_is_valid(method):
     >>> output_method_is_valid('curses')
     True
     """
-    return method in get_valid_output_methods()
+    return method in _VALID_OUTPUT_METHODS
+
+
+def read_small_file(filename, size=SMALL_FILE_READ_SIZE):
+    """ read up to size bytes of a small file, i.e. from /proc, with a single unbuffered read """
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        while True:
+            try:
+                return os.read(fd, size)
+            except OSError as e:
+                # Python 3.5+ retries the interrupted calls by itself
+                if e.errno != errno.EINTR:
+                    raise
+    except OSError as e:
+        # unlike os.open, os.read does not tell which file has failed
+        e.filename = filename
+        raise
+    finally:
+        os.close(fd)
+
+
+def split_proc_stat(stat, maxsplit=-1):
+    """ split the contents of /proc/[pid]/stat into fields, keeping the process name as a single field.
+
+        The process name may contain spaces and parentheses, so it spans up to the last ')'
+        and the remaining fields are located after it. Field positions match STAT_FIELD.
+
+    >>> split_proc_stat('42 (post master) S 1 42')
+    ['42', '(post master)', 'S', '1', '42']
+    >>> split_proc_stat('42 (a) b) S 1 42', 3)
+    ['42', '(a) b)', 'S', '1 42']
+    """
+    end = stat.rfind(b')' if isinstance(stat, bytes) else ')') + 1
+    if not end:
+        return stat.split(None, maxsplit)
+    return stat[:end].split(None, 1) + stat[end:].split(None, maxsplit - 2 if maxsplit >= 2 else -1)
+
+
+def proc_data_to_str(data):
+    """ convert the bytes read from /proc to the native str, keeping them as they are on Python 2
+
+    >>> proc_data_to_str(b'postgres: writer process') == 'postgres: writer process'
+    True
+    """
+    return data if str is bytes else data.decode('utf-8', 'replace')
+
+
+class ProcFile(object):
+    """ a /proc file that is kept open between the reads.
+
+        Every read rewinds the descriptor, which makes the kernel generate the content anew,
+        so that refreshes do not pay for opening and closing the file.
+    """
+
+    def __init__(self, filename, size=PROC_FILE_READ_SIZE):
+        self.filename = filename
+        self.size = size
+        self.fd = None
+
+    def read(self):
+        """ read the whole file with unbuffered reads of up to size bytes """
+        chunks = []
+        if self.fd is None:
+            self.fd = os.open(self.filename, os.O_RDONLY)
+        try:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            while True:
+                chunk = os.read(self.fd, self.size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except OSError as e:
+            # start with a fresh descriptor next time
+            self.close()
+            e.filename = self.filename
+            raise
+        return b''.join(chunks)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
 
 
 def read_configuration(config_file_name):
@@ -53,16 +136,11 @@ def read_configuration(config_file_name):
     # get through all defined databases
     for section in config.sections():
         config_data[section] = {}
-        for argname in (
-                'port',
-                'host',
-                'user',
-                'dbname',
-        ):
-            try:
-                val = config.get(section, argname)
-            except ConfigParser.NoOptionError:
-                val = None
+        # only get() the options we need, so that the values of the others are not interpolated
+        for argname in _CONFIGURATION_OPTIONS:
+            if not config.has_option(section, argname):
+                continue
+            val = config.get(section, argname)
             # might happen also if the option is there, but the value is not set
             if val is not None:
                 config_data[section][argname] = val
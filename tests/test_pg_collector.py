@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+import time
+
+from pg_view.collectors.pg_collector import PgstatCollector
+
+
+class FakeCursor(object):
+    def execute(self, sql):
+        pass
+
+    def fetchone(self):
+        return ('100',)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def cursor(self):
+        return FakeCursor()
+
+    def get_backend_pid(self):
+        return 0
+
+    def get_parameter_status(self, name):
+        return '11.5'
+
+
+def test_read_proc_non_ascii_cmdline():
+    title = u'postgres: writer process sélect'
+    # Python 2 passes the arguments as they are, Python 3 encodes them with the filesystem encoding
+    arg = title.encode('utf-8') if str is bytes else title
+    proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)', arg])
+    try:
+        collector = PgstatCollector(FakeConnection(), None, None, 'test', 11.0, [])
+        # wait for the interpreter to start with the new command line
+        for _ in range(50):
+            result = collector._read_proc(proc.pid, False)
+            if result and 'writer' in result['cmdline']:
+                break
+            time.sleep(0.1)
+        assert isinstance(result['cmdline'], str)
+        # the output is cooked with str(), which must not fail on the native string
+        assert str(result['cmdline']).endswith(title.encode('utf-8') if str is bytes else title)
+    finally:
+        proc.kill()
+        proc.wait()